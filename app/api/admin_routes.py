@@ -1,28 +1,81 @@
 """
 管理员API路由
 """
-from typing import List
+import asyncio
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import SQLAlchemyError
 
 from app.api.schemas import (
-    UserResponse, UserUpdate, StatsResponse,
+    UserResponse, to_user_response, UserUpdate, StatsResponse,
     UserStatsResponse, SuccessResponse, ConfigResponse,
     StorageConfigRequest
 )
+from app.core.cache import get_cache_manager
 from app.core.config import get_settings
-from app.core.security import get_current_active_user
-from app.models import User, FileRecord, FileStatus
+from app.core.security import (
+    ADMIN_USER_ID, security, get_auth_manager,
+    get_current_user, get_current_active_user
+)
+from app.models import User, FileRecord, FileStatus, StorageType
 
 router = APIRouter(prefix="/admin", tags=["管理"])
 settings = get_settings()
+cache_manager = get_cache_manager()
+auth_manager = get_auth_manager()
+
+# 统计缓存过期时间（秒）
+STATS_CACHE_TTL = 30
+
+# 系统配置响应，配置在运行期间不变，只需构建一次
+_config_response: Optional[ConfigResponse] = None
+
+
+def build_user_responses(users: List[Row]) -> List[UserResponse]:
+    """批量构建用户响应
+
+    数据来自数据库，直接使用 model_construct 跳过逐行校验，派生字段已在查询中计算。
+    """
+    return [
+        UserResponse.model_construct(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            storage_type=StorageType(user.storage_type),
+            storage_quota=user.storage_quota,
+            storage_used=user.storage_used,
+            remaining_storage=user.remaining_storage,
+            storage_usage_percent=user.storage_usage_percent,
+            is_active=user.is_active,
+            created_at=user.created_at,
+            updated_at=user.updated_at
+        )
+        for user in users
+    ]
+
+
+async def invalidate_stats_cache(user_id: int):
+    """用户数据变更后清除相关统计缓存"""
+    await cache_manager.delete_stats_cache("system", f"user:{user_id}")
+
 
+async def get_admin_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    """验证管理员权限
 
-async def get_admin_user(current_user: User = Depends(get_current_active_user)):
-    """验证管理员权限"""
+    访问令牌携带管理员声明时通过缓存的用户查询校验管理员是否启用；否则走完整的用户认证流程。
+    """
     # 这里简化实现，实际应该在User模型中添加is_admin字段
-    # 暂时以user_id=1作为管理员
-    if current_user.id != 1:
+    if settings.security.enable_auth and credentials:
+        admin_user = await auth_manager.get_admin_from_token(credentials.credentials)
+        if admin_user:
+            return admin_user
+    
+    current_user = await get_current_active_user(await get_current_user(credentials))
+    if current_user.id != ADMIN_USER_ID:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="需要管理员权限"
@@ -30,34 +83,32 @@ async def get_admin_user(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 
-@router.get("/users", response_model=List[UserResponse], summary="获取用户列表")
+@router.get("/users", response_model=List[UserResponse], response_class=ORJSONResponse, summary="获取用户列表")
 async def get_users(
+    response: Response,
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页大小"),
+    cursor_id: Optional[int] = Query(None, ge=1, description="游标，上一页最后一个用户ID"),
     admin_user: User = Depends(get_admin_user)
 ):
-    """获取用户列表"""
-    try:
-        from app.crud.user import get_users_paginated
-        
+    """获取用户列表
+
+    传入 cursor_id 时使用游标分页，未传入时保持原有的页码分页；
+    下一页游标均通过响应头 X-Next-Cursor 返回。
+    """
+    from app.crud.user import get_users_paginated
+    
+    if cursor_id is not None:
+        users = await get_users_paginated(limit=page_size, cursor_id=cursor_id)
+    else:
         offset = (page - 1) * page_size
         users = await get_users_paginated(offset, page_size)
-        
-        user_responses = []
-        for user in users:
-            user_responses.append(UserResponse(
-                **user.dict(),
-                remaining_storage=user.remaining_storage,
-                storage_usage_percent=user.storage_usage_percent
-            ))
-        
-        return user_responses
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取用户列表失败: {str(e)}"
-        )
+    
+    # 满页时返回下一页游标
+    if len(users) == page_size:
+        response.headers["X-Next-Cursor"] = str(users[-1].id)
+    
+    return build_user_responses(users)
 
 
 @router.get("/users/{user_id}", response_model=UserResponse, summary="获取用户详情")
@@ -66,29 +117,16 @@ async def get_user(
     admin_user: User = Depends(get_admin_user)
 ):
     """获取用户详情"""
-    try:
-        from app.crud.user import get_user_by_id
-        
-        user = await get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-        
-        return UserResponse(
-            **user.dict(),
-            remaining_storage=user.remaining_storage,
-            storage_usage_percent=user.storage_usage_percent
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
+    from app.crud.user import get_user_by_id
+    
+    user = await get_user_by_id(user_id)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
+    
+    return to_user_response(user)
 
 
 @router.put("/users/{user_id}", response_model=UserResponse, summary="更新用户信息")
@@ -98,36 +136,26 @@ async def update_user(
     admin_user: User = Depends(get_admin_user)
 ):
     """更新用户信息"""
-    try:
-        from app.crud.user import get_user_by_id, update_user as update_user_crud
-        
-        user = await get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-        
-        update_data = user_update.dict(exclude_unset=True)
-        if update_data:
-            user = await update_user_crud(user_id, **update_data)
-            if not user:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="更新用户失败"
-                )
-        
-        return UserResponse(
-            **user.dict(),
-            remaining_storage=user.remaining_storage,
-            storage_usage_percent=user.storage_usage_percent
-        )
-        
-    except Exception as e:
+    from app.crud.user import get_user_by_id, update_user as update_user_crud
+    
+    user = await get_user_by_id(user_id)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
+    
+    update_data = user_update.dict(exclude_unset=True)
+    if update_data:
+        user = await update_user_crud(user_id, **update_data)
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="更新用户失败"
+            )
+        await invalidate_stats_cache(user_id)
+    
+    return to_user_response(user)
 
 
 @router.delete("/users/{user_id}", response_model=SuccessResponse, summary="删除用户")
@@ -136,100 +164,75 @@ async def delete_user(
     admin_user: User = Depends(get_admin_user)
 ):
     """删除用户（软删除）"""
-    try:
-        from app.crud.user import get_user_by_id, update_user as update_user_crud
-        
-        if user_id == admin_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="不能删除自己的账户"
-            )
-        
-        user = await get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-            
-        updated_user = await update_user_crud(user_id, is_active=False)
-        if not updated_user:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="删除用户失败"
-            )
-        
-        return SuccessResponse(message="用户删除成功")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
+    from app.crud.user import get_user_by_id, update_user as update_user_crud
+    
+    if user_id == admin_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="不能删除自己的账户"
+        )
+    
+    user = await get_user_by_id(user_id)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
+        
+    updated_user = await update_user_crud(user_id, is_active=False)
+    if not updated_user:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="删除用户失败"
+        )
+    await invalidate_stats_cache(user_id)
+    
+    return SuccessResponse(message="用户删除成功")
 
 
-@router.get("/stats", response_model=StatsResponse, summary="获取系统统计")
+@router.get("/stats", response_model=StatsResponse, response_class=ORJSONResponse, summary="获取系统统计")
 async def get_system_stats(admin_user: User = Depends(get_admin_user)):
     """获取系统统计信息"""
+    cached_stats = await cache_manager.get_stats_cache("system")
+    if cached_stats:
+        return StatsResponse(**cached_stats)
+    
+    from app.crud.stats import get_system_totals, get_files_by_format, get_storage_by_type
+    
     try:
-        from app.crud.user import get_all_users
-        from app.crud.file import get_user_files_count
-        from app.core.database import database
-        from app.models import users_table, file_records_table
-        from sqlalchemy import func
-        
-        # 总用户数
-        total_users_query = users_table.select().with_only_columns([func.count(users_table.c.id)])
-        total_users_result = await database.fetch_one(total_users_query)
-        total_users = total_users_result[0] if total_users_result else 0
-        
-        # 总文件数
-        total_files_query = file_records_table.select().with_only_columns([func.count(file_records_table.c.id)]).where(
-            file_records_table.c.status == FileStatus.ACTIVE.value
-        )
-        total_files_result = await database.fetch_one(total_files_query)
-        total_files = total_files_result[0] if total_files_result else 0
-        
-        # 总存储使用量
-        storage_used_query = users_table.select().with_only_columns([func.sum(users_table.c.storage_used)])
-        storage_used_result = await database.fetch_one(storage_used_query)
-        total_storage_used = storage_used_result[0] if storage_used_result and storage_used_result[0] else 0
-        
-        # 总下载次数
-        downloads_query = file_records_table.select().with_only_columns([func.sum(file_records_table.c.download_count)]).where(
-            file_records_table.c.status == FileStatus.ACTIVE.value
+        # 汇总数据与分组统计相互独立，并发查询
+        totals, files_by_format, storage_by_type = await asyncio.gather(
+            get_system_totals(),
+            get_files_by_format(),
+            get_storage_by_type()
         )
-        downloads_result = await database.fetch_one(downloads_query)
-        total_downloads = downloads_result[0] if downloads_result and downloads_result[0] else 0
-        
-        # 按格式统计文件 - 简化版本
-        files_by_format = {"jpg": 0, "png": 0, "gif": 0, "other": 0}
-        
-        # 按存储类型统计 - 简化版本  
-        storage_by_type = {"local": int(total_storage_used), "webdav": 0, "s3": 0}
-        
-        return StatsResponse(
-            total_files=total_files,
-            total_storage_used=total_storage_used,
-            total_downloads=total_downloads,
-            files_by_format=files_by_format,
-            storage_by_type=storage_by_type
-        )
-        
-    except Exception as e:
+    except SQLAlchemyError:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取统计信息失败: {str(e)}"
+            detail="获取统计信息失败"
         )
+    total_files = totals["total_files"]
+    total_storage_used = totals["total_storage_used"]
+    total_downloads = totals["total_downloads"]
+    
+    stats = StatsResponse(
+        total_files=total_files,
+        total_storage_used=total_storage_used,
+        total_downloads=total_downloads,
+        files_by_format=files_by_format,
+        storage_by_type=storage_by_type
+    )
+    await cache_manager.set_stats_cache("system", stats.model_dump(), ttl=STATS_CACHE_TTL)
+    
+    return stats
 
 
 @router.get("/config", response_model=ConfigResponse, summary="获取系统配置")
 async def get_system_config(admin_user: User = Depends(get_admin_user)):
     """获取系统配置"""
-    try:
-        return ConfigResponse(
+    global _config_response
+    if _config_response is None:
+        _config_response = ConfigResponse(
             max_file_size=settings.app.max_file_size,
             allowed_extensions=settings.app.allowed_extensions,
             storage_types=["local", "webdav", "s3"],
@@ -237,12 +240,7 @@ async def get_system_config(admin_user: User = Depends(get_admin_user)):
             thumbnail_size=settings.app.thumbnail_size,
             preview_size=settings.app.preview_size
         )
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取配置失败: {str(e)}"
-        )
+    return _config_response
 
 
 @router.post("/users/{user_id}/storage", response_model=SuccessResponse, summary="更新用户存储配置")
@@ -252,97 +250,74 @@ async def update_user_storage(
     admin_user: User = Depends(get_admin_user)
 ):
     """更新用户存储配置"""
-    try:
-        from app.crud.user import get_user_by_id, update_user as update_user_crud
-        
-        user = await get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-        
-        updated_user = await update_user_crud(
-            user_id,
-            storage_type=storage_config.storage_type,
-            storage_config=storage_config.config
-        )
-        
-        if not updated_user:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="更新存储配置失败"
-            )
-        
-        return SuccessResponse(message="存储配置更新成功")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
+    from app.crud.user import get_user_by_id, update_user as update_user_crud
+    
+    user = await get_user_by_id(user_id)
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
+    
+    updated_user = await update_user_crud(
+        user_id,
+        storage_type=storage_config.storage_type,
+        storage_config=storage_config.config
+    )
+    
+    if not updated_user:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="更新存储配置失败"
+        )
+    await invalidate_stats_cache(user_id)
+    
+    return SuccessResponse(message="存储配置更新成功")
 
 
-@router.get("/users/{user_id}/stats", response_model=UserStatsResponse, summary="获取用户统计")
+@router.get("/users/{user_id}/stats", response_model=UserStatsResponse, response_class=ORJSONResponse, summary="获取用户统计")
 async def get_user_stats(
     user_id: int,
     admin_user: User = Depends(get_admin_user)
 ):
     """获取用户统计信息"""
+    cached_stats = await cache_manager.get_stats_cache(f"user:{user_id}")
+    if cached_stats:
+        return UserStatsResponse(**cached_stats)
+    
+    from app.crud.user import get_user_by_id
+    from app.crud.stats import get_user_file_stats
+    
     try:
-        from app.crud.user import get_user_by_id
-        from app.crud.file import get_user_files_count
-        from app.core.database import database
-        from app.models import file_records_table
-        from sqlalchemy import func
-        
-        user = await get_user_by_id(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="用户不存在"
-            )
-        
-        # 文件数量
-        file_count_query = file_records_table.select().with_only_columns([func.count(file_records_table.c.id)]).where(
-            (file_records_table.c.user_id == user.id) &
-            (file_records_table.c.status == FileStatus.ACTIVE.value)
-        )
-        file_count_result = await database.fetch_one(file_count_query)
-        file_count = file_count_result[0] if file_count_result else 0
-        
-        # 总下载次数
-        downloads_query = file_records_table.select().with_only_columns([func.sum(file_records_table.c.download_count)]).where(
-            (file_records_table.c.user_id == user.id) &
-            (file_records_table.c.status == FileStatus.ACTIVE.value)
-        )
-        downloads_result = await database.fetch_one(downloads_query)
-        total_downloads = downloads_result[0] if downloads_result and downloads_result[0] else 0
-        
-        # 最近7天上传数
-        from datetime import datetime, timedelta
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_uploads_query = file_records_table.select().with_only_columns([func.count(file_records_table.c.id)]).where(
-            (file_records_table.c.user_id == user.id) &
-            (file_records_table.c.status == FileStatus.ACTIVE.value) &
-            (file_records_table.c.created_at >= week_ago)
+        # 统计查询不依赖用户记录，与用户查询并发执行
+        file_stats, user = await asyncio.gather(
+            get_user_file_stats(user_id),
+            get_user_by_id(user_id)
         )
-        recent_uploads_result = await database.fetch_one(recent_uploads_query)
-        recent_uploads = recent_uploads_result[0] if recent_uploads_result else 0
-        
-        return UserStatsResponse(
-            file_count=file_count,
-            storage_used=user.storage_used,
-            storage_quota=user.storage_quota,
-            storage_usage_percent=user.storage_usage_percent,
-            total_downloads=total_downloads,
-            recent_uploads=recent_uploads
+    except SQLAlchemyError:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="获取用户统计失败"
         )
-        
-    except Exception as e:
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
         )
+    
+    # 文件数量、总下载次数、最近7天上传数
+    file_count = file_stats["file_count"]
+    total_downloads = file_stats["total_downloads"]
+    recent_uploads = file_stats["recent_uploads"]
+    
+    user_stats = UserStatsResponse(
+        file_count=file_count,
+        storage_used=user.storage_used,
+        storage_quota=user.storage_quota,
+        storage_usage_percent=user.storage_usage_percent,
+        total_downloads=total_downloads,
+        recent_uploads=recent_uploads
+    )
+    await cache_manager.set_stats_cache(f"user:{user_id}", user_stats.model_dump(), ttl=STATS_CACHE_TTL)
+    
+    return user_stats
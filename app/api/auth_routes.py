@@ -7,7 +7,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app.api.schemas import (
-    UserCreate, UserResponse, Token,
+    UserCreate, UserResponse, to_user_response, Token,
     SuccessResponse
 )
 from app.core.cache import get_cache_manager
@@ -23,22 +23,15 @@ cache_manager = get_cache_manager()
 async def register(user_data: UserCreate):
     """用户注册"""
     try:
-        from app.crud.user import get_user_by_username, get_user_by_email, create_user
+        from app.crud.user import get_username_email_conflict, create_user
         
-        # 检查用户名是否已存在
-        existing_user = await get_user_by_username(user_data.username)
-        if existing_user:
+        # 检查用户名或邮箱是否已存在
+        conflict = await get_username_email_conflict(user_data.username, user_data.email)
+        if conflict:
+            existing_username, _ = conflict
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="用户名已存在"
-            )
-        
-        # 检查邮箱是否已存在
-        existing_email = await get_user_by_email(user_data.email)
-        if existing_email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="邮箱已被使用"
+                detail="用户名已存在" if existing_username == user_data.username else "邮箱已被使用"
             )
         
         # 创建用户
@@ -58,11 +51,7 @@ async def register(user_data: UserCreate):
             )
         
         # 转换为响应模型
-        return UserResponse(
-            **user.dict(),
-            remaining_storage=user.remaining_storage,
-            storage_usage_percent=user.storage_usage_percent
-        )
+        return to_user_response(user)
         
     except HTTPException:
         raise
@@ -89,7 +78,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         # 创建访问令牌
         access_token_expires = timedelta(minutes=auth_manager.access_token_expire_minutes)
         access_token = auth_manager.create_access_token(
-            data={"sub": str(user.id), "username": user.username},
+            data=auth_manager.build_token_data(user),
             expires_delta=access_token_expires
         )
         
@@ -135,11 +124,7 @@ async def logout(current_user: User = Depends(get_current_active_user)):
 async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
     """获取当前用户信息"""
     try:
-        return UserResponse(
-            **current_user.dict(),
-            remaining_storage=current_user.remaining_storage,
-            storage_usage_percent=current_user.storage_usage_percent
-        )
+        return to_user_response(current_user)
         
     except Exception as e:
         raise HTTPException(
@@ -162,7 +147,7 @@ async def refresh_token(current_user: User = Depends(get_current_user)):
         # 创建新的访问令牌
         access_token_expires = timedelta(minutes=auth_manager.access_token_expire_minutes)
         access_token = auth_manager.create_access_token(
-            data={"sub": str(current_user.id), "username": current_user.username},
+            data=auth_manager.build_token_data(current_user),
             expires_delta=access_token_expires
         )
         
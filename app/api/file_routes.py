@@ -1,87 +1,259 @@
 """
 文件管理API路由
 """
-import hashlib
+import asyncio
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple, BinaryIO
 
 from fastapi import (
-    APIRouter, Depends, HTTPException, status,
-    UploadFile, File, Form, Query, Response
+    APIRouter, BackgroundTasks, Depends, HTTPException, status,
+    UploadFile, File, Form, Query, Request, Response
 )
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from app.api.schemas import (
     FileUploadResponse, FileResponse, FileListResponse,
+    FileHashCheckRequest, FileHashCheckResponse,
     FileShareRequest, FileShareResponse, SuccessResponse
 )
 from app.core.cache import get_cache_manager
 from app.core.config import get_settings
-from app.core.security import get_current_user, get_current_active_user, verify_file_access, get_auth_manager
+from app.core.logger import logger
+from app.core.security import (
+    get_current_user, get_current_active_user, verify_file_access_cached, get_auth_manager
+)
+from app.core.utils import calculate_file_hash_stream, get_date_path, parse_range_header
+from app.crud.file import (
+    file_hash_exists, get_file_by_hash, get_user_files, get_user_file_cursor, get_user_files_page, get_user_active_file,
+    create_file_record, update_file_record, delete_file_record, queue_download_count
+)
 from app.models import User, FileRecord, FileStatus
 from app.services.image_service import get_image_processor, ImageProcessorException
 from app.services.storage_service import get_storage_manager
+from app.storage import BaseStorage
 
-router = APIRouter(prefix="/files", tags=["文件管理"])
+router = APIRouter(prefix="/files", tags=["文件管理"], default_response_class=ORJSONResponse)
 auth_manager = get_auth_manager()
 image_processor = get_image_processor()
 cache_manager = get_cache_manager()
 storage_manager = get_storage_manager()
 settings = get_settings()
 
+# 上传文件分块读取大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 上传限制在模块加载时取出，扩展名检查使用集合
+ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in settings.app.allowed_extensions)
+MAX_FILE_SIZE = settings.app.max_file_size
+
+# 下载时缓存文件内容的大小上限
+FILE_CACHE_MAX_SIZE = 1024 * 1024
+
+# 上传后预先生成并保存的缩放图片：(宽, 高, 格式, 质量)，与缩略图、预览图接口的默认参数一致
+CANONICAL_IMAGE_SIZES = frozenset({
+    (200, 200, "webp", 75),
+    (800, 600, "webp", 85),
+})
+
+
+def canonical_image_path(file_path: str, size: Tuple[int, int], output_format: str) -> str:
+    """预生成缩放图片的存储路径"""
+    return f"{file_path}.thumb.{size[0]}x{size[1]}.{output_format}"
+
+
+async def generate_canonical_images(storage: BaseStorage, file_path: str):
+    """为新上传的图片生成常用尺寸的缩放图片并保存到存储，作为后台任务执行"""
+    try:
+        file_data = await storage.get_file(file_path)
+        if file_data is None:
+            return
+        for width, height, output_format, quality in CANONICAL_IMAGE_SIZES:
+            image_data = await image_processor.resize_image(
+                file_data,
+                (width, height),
+                keep_aspect_ratio=True,
+                output_format=output_format,
+                quality=quality
+            )
+            await storage.save_file(canonical_image_path(file_path, (width, height), output_format), image_data)
+    except Exception as e:
+        logger.error(f"预生成缩放图片失败 {file_path}: {str(e)}")
+
+
+# 上传并发控制，信号量在首次使用时创建以绑定到运行中的事件循环
+_upload_semaphore: Optional[asyncio.Semaphore] = None
+_queued_uploads = 0
+
+
+async def acquire_upload_slot():
+    """限制同时处理的上传数量，等待的上传过多时直接返回503"""
+    global _upload_semaphore, _queued_uploads
+    if _upload_semaphore is None:
+        _upload_semaphore = asyncio.Semaphore(settings.app.max_concurrent_uploads)
+    
+    if _upload_semaphore.locked() and _queued_uploads >= settings.app.max_queued_uploads:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="上传请求过多，请稍后重试"
+        )
+    
+    _queued_uploads += 1
+    try:
+        await _upload_semaphore.acquire()
+    finally:
+        _queued_uploads -= 1
+    
+    try:
+        yield
+    finally:
+        _upload_semaphore.release()
+
+
+@lru_cache(maxsize=4096)
+def file_urls(file_id: int) -> Tuple[str, str, str]:
+    """文件的下载、缩略图和预览图URL"""
+    return f"/files/{file_id}/download", f"/files/{file_id}/thumbnail", f"/files/{file_id}/preview"
+
+
+@lru_cache(maxsize=4096)
+def download_headers(download: bool, original_filename: str) -> Dict[str, str]:
+    """文件下载响应头模板，使用时需复制后再补充长度等字段"""
+    disposition = "attachment" if download else "inline"
+    return {
+        "Content-Disposition": f"{disposition}; filename={original_filename}",
+        "Accept-Ranges": "bytes"
+    }
+
+
+@lru_cache(maxsize=64)
+def cache_control_headers(max_age: int) -> Dict[str, str]:
+    """缩放图片响应的缓存控制头，只读使用"""
+    return {"Cache-Control": f"public, max-age={max_age}"}
+
+
+def build_file_response(file_record: FileRecord) -> FileResponse:
+    """构建文件响应
+
+    数据来自数据库，直接使用 model_construct 跳过字段校验。
+    """
+    download_url, thumbnail_url, preview_url = file_urls(file_record.id)
+    is_image = file_record.is_image
+    return FileResponse.model_construct(
+        id=file_record.id,
+        filename=file_record.filename,
+        original_filename=file_record.original_filename,
+        file_path=file_record.file_path,
+        file_size=file_record.file_size,
+        content_type=file_record.content_type,
+        file_hash=file_record.file_hash,
+        width=file_record.width,
+        height=file_record.height,
+        format=file_record.format,
+        status=FileStatus(file_record.status),
+        download_count=file_record.download_count,
+        download_url=download_url,
+        thumbnail_url=thumbnail_url if is_image else None,
+        preview_url=preview_url if is_image else None,
+        share_url=None,
+        created_at=file_record.created_at,
+        updated_at=file_record.updated_at,
+        expires_at=file_record.expires_at
+    )
+
+
+def read_upload_chunk(fileobj: BinaryIO, position: int) -> bytes:
+    """从指定位置读取上传文件的一个分块"""
+    fileobj.seek(position)
+    return fileobj.read(UPLOAD_CHUNK_SIZE)
+
+
+async def iter_upload_chunks(file: UploadFile, lock: asyncio.Lock):
+    """从头分块读取上传文件，供存储后端流式写入
+
+    直接读取 UploadFile 底层的临时文件，定位和读取在同一次线程调用中完成；
+    每次读取前在锁内重新定位，允许与图片信息读取交替访问同一上传文件。
+    """
+    position = 0
+    while True:
+        async with lock:
+            chunk = await asyncio.to_thread(read_upload_chunk, file.file, position)
+        if not chunk:
+            break
+        position += len(chunk)
+        yield chunk
+
+
+async def read_image_info(file: UploadFile, lock: asyncio.Lock) -> Dict[str, Any]:
+    """读取上传图片的信息，处理失败时返回空字典"""
+    async with lock:
+        await file.seek(0)
+        try:
+            return await image_processor.get_image_info(file.file)
+        except ImageProcessorException:
+            return {}  # 忽略图片处理错误
+
 
 @router.post("/upload", response_model=FileUploadResponse, summary="上传文件")
 async def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="要上传的文件"),
     auto_rename: bool = Form(default=True, description="是否自动重命名"),
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_active_user),
+    _: None = Depends(acquire_upload_slot)
 ):
     """上传文件"""
+    # 已预留但尚未由文件记录占用的存储空间，上传失败时归还
+    storage_reserved = 0
     try:
         # 检查文件大小
-        if file.size and file.size > settings.app.max_file_size:
+        if file.size and file.size > MAX_FILE_SIZE:
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"文件大小超过限制 ({settings.app.max_file_size} 字节)"
+                detail=f"文件大小超过限制 ({MAX_FILE_SIZE} 字节)"
             )
         
         # 检查文件扩展名
         file_ext = Path(file.filename).suffix.lower()
-        if file_ext not in settings.app.allowed_extensions:
+        if file_ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"不支持的文件类型: {file_ext}"
             )
         
-        # 读取文件内容
-        file_content = await file.read()
-        file_size = len(file_content)
+        # 在线程中分块读取底层临时文件并计算哈希，不复制整个文件内容
+        file_hash, file_size = await asyncio.to_thread(
+            calculate_file_hash_stream, file.file, settings.app.hash_algorithm, UPLOAD_CHUNK_SIZE, MAX_FILE_SIZE
+        )
+        if file_size > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"文件大小超过限制 ({MAX_FILE_SIZE} 字节)"
+            )
         
-        # 检查存储配额
-        if not await auth_manager.check_storage_quota(current_user, file_size):
+        # 检查存储配额并原子预留空间
+        if not await auth_manager.reserve_storage(current_user, file_size):
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                 detail="存储空间不足"
             )
-        
-        # 计算文件哈希
-        file_hash = hashlib.md5(file_content).hexdigest()
-        
-        # 检查是否已存在相同文件
-        existing_file = await FileRecord.objects.filter(
-            user=current_user.id,
-            file_hash=file_hash,
-            status=FileStatus.ACTIVE
-        ).first()
-        
-        if existing_file and not auto_rename:
+        storage_reserved = file_size
+        
+        # 自动重命名时文件名总是重新生成，只有保留原文件名时才需要检查重复文件；
+        # Redis哈希集合加载完成且未命中时可确定文件不存在，跳过数据库查询；无法判断时查询数据库
+        if (
+            not auto_rename
+            and await cache_manager.has_file_hash(current_user.id, file_hash) is not False
+            and await file_hash_exists(file_hash, current_user.id)
+        ):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="文件已存在"
             )
         
         # 生成文件名
-        if auto_rename or existing_file:
+        if auto_rename:
             filename = auth_manager.generate_secure_filename(file.filename, current_user.id)
         else:
             filename = file.filename
@@ -90,52 +262,59 @@ async def upload_file(
         storage = storage_manager.get_storage_for_user(current_user)
         
         # 构建文件路径
-        file_path = f"{datetime.utcnow().strftime('%Y/%m/%d')}/{filename}"
+        file_path = f"{get_date_path()}/{filename}"
+        
+        # 保存文件，图片信息读取与存储写入相互独立，并发执行
+        file_lock = asyncio.Lock()
+        save_task = storage.save_file_stream(file_path, iter_upload_chunks(file, file_lock))
+        if image_processor.is_supported_format(file_ext):
+            success, image_info = await asyncio.gather(save_task, read_image_info(file, file_lock))
+        else:
+            success, image_info = await save_task, {}
         
-        # 保存文件
-        success = await storage.save_file(file_path, file_content)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="文件保存失败"
             )
         
-        # 获取图片信息（如果是图片）
-        width, height, format_name = None, None, None
-        if image_processor.is_supported_format(file_ext):
-            try:
-                image_info = await image_processor.get_image_info(file_content)
-                width = image_info.get("width")
-                height = image_info.get("height")
-                format_name = image_info.get("format")
-            except ImageProcessorException:
-                pass  # 忽略图片处理错误
+        width = image_info.get("width")
+        height = image_info.get("height")
+        format_name = image_info.get("format")
         
         # 创建文件记录
-        file_record = await FileRecord.objects.create(
-            user=current_user.id,
+        file_record = await create_file_record(
+            current_user.id,
             filename=filename,
             original_filename=file.filename,
             file_path=file_path,
             file_size=file_size,
             content_type=file.content_type or "application/octet-stream",
             file_hash=file_hash,
-            width=width,
-            height=height,
-            format=format_name,
-            status=FileStatus.ACTIVE
+            width=width or 0,
+            height=height or 0,
+            format=format_name or "",
+            status=FileStatus.ACTIVE.value
         )
+        if not file_record:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="创建文件记录失败"
+            )
         
-        # 更新用户存储使用量
-        await auth_manager.update_storage_usage(current_user, file_size)
+        # 存储使用量已在预留时计入；新文件ID上可能缓存的不存在结果已在创建记录时清除
+        storage_reserved = 0
+        await cache_manager.add_file_hash(current_user.id, file_hash)
+        
+        # 后台预生成常用尺寸的缩放图片
+        if image_processor.is_supported_format(file_ext):
+            background_tasks.add_task(generate_canonical_images, storage, file_path)
         
-        # 生成响应URLs
-        base_url = f"/files/{file_record.id}"
-        download_url = f"{base_url}/download"
-        thumbnail_url = f"{base_url}/thumbnail" if file_record.is_image else None
-        preview_url = f"{base_url}/preview" if file_record.is_image else None
+        # 生成响应
+        download_url, thumbnail_url, preview_url = file_urls(file_record.id)
+        is_image = file_record.is_image
         
-        return FileUploadResponse(
+        return FileUploadResponse.model_construct(
             id=file_record.id,
             filename=file_record.filename,
             original_filename=file_record.original_filename,
@@ -146,66 +325,96 @@ async def upload_file(
             height=file_record.height,
             format=file_record.format,
             download_url=download_url,
-            thumbnail_url=thumbnail_url,
-            preview_url=preview_url,
+            thumbnail_url=thumbnail_url if is_image else None,
+            preview_url=preview_url if is_image else None,
+            share_url=None,
             created_at=file_record.created_at
         )
         
     except HTTPException:
+        if storage_reserved:
+            await auth_manager.update_storage_usage(current_user, -storage_reserved)
         raise
     except Exception as e:
+        if storage_reserved:
+            await auth_manager.update_storage_usage(current_user, -storage_reserved)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"上传失败: {str(e)}"
         )
 
 
+@router.post("/upload/check", response_model=FileHashCheckResponse, summary="上传前检查文件是否已存在")
+async def check_file_hash(
+    check_request: FileHashCheckRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """上传前按哈希检查文件是否已存在
+
+    客户端预先计算文件哈希，已存在时直接复用已有文件，无需再次上传。
+    Redis中的哈希集合未命中时不查询数据库。
+    """
+    hash_algorithm = settings.app.hash_algorithm
+    
+    if await cache_manager.has_file_hash(current_user.id, check_request.file_hash) is False:
+        return FileHashCheckResponse(exists=False, hash_algorithm=hash_algorithm)
+    
+    file_record = await get_file_by_hash(check_request.file_hash, current_user.id)
+    if not file_record or file_record.file_size != check_request.file_size:
+        return FileHashCheckResponse(exists=False, hash_algorithm=hash_algorithm)
+    
+    return FileHashCheckResponse(
+        exists=True,
+        hash_algorithm=hash_algorithm,
+        file=build_file_response(file_record)
+    )
+
+
 @router.get("/", response_model=FileListResponse, summary="获取文件列表")
 async def get_file_list(
+    response: Response,
     page: int = Query(1, ge=1, description="页码"),
     page_size: int = Query(20, ge=1, le=100, description="每页大小"),
     status_filter: Optional[FileStatus] = Query(None, description="状态过滤"),
     format_filter: Optional[str] = Query(None, description="格式过滤"),
+    cursor_id: Optional[int] = Query(None, ge=1, description="游标，上一页最后一个文件ID"),
     current_user: User = Depends(get_current_active_user)
 ):
-    """获取用户文件列表"""
+    """获取用户文件列表
+
+    传入 cursor_id 时使用游标分页，未传入时保持原有的页码分页；
+    下一页游标均通过响应头 X-Next-Cursor 返回。游标分页不统计总数，total 和 total_pages 为空。
+    """
+    total = None
+    if cursor_id is not None:
+        cursor = await get_user_file_cursor(current_user.id, cursor_id)
+        if cursor is None:
+            # 游标文件已被彻底删除或不属于当前用户，无法确定位置
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的分页游标"
+            )
+    
     try:
-        # 构建查询
-        query = FileRecord.objects.filter(user=current_user.id)
-        
-        if status_filter:
-            query = query.filter(status=status_filter)
+        if cursor_id is not None:
+            # 游标分页直接定位到上一页之后
+            files = await get_user_files(current_user.id, limit=page_size, status=status_filter,
+                                         format_name=format_filter, cursor=cursor)
         else:
-            query = query.filter(status=FileStatus.ACTIVE)
-        
-        if format_filter:
-            query = query.filter(format=format_filter)
-        
-        # 计算总数
-        total = await query.count()
+            # 分页查询，总数随分页数据一并返回
+            offset = (page - 1) * page_size
+            files, total = await get_user_files_page(current_user.id, offset, page_size, status_filter, format_filter)
         
-        # 分页查询
-        offset = (page - 1) * page_size
-        files = await query.offset(offset).limit(page_size).order_by("-created_at").all()
+        # 满页时返回下一页游标
+        if len(files) == page_size:
+            response.headers["X-Next-Cursor"] = str(files[-1].id)
         
         # 转换为响应格式
-        file_responses = []
-        for file_record in files:
-            base_url = f"/files/{file_record.id}"
-            download_url = f"{base_url}/download"
-            thumbnail_url = f"{base_url}/thumbnail" if file_record.is_image else None
-            preview_url = f"{base_url}/preview" if file_record.is_image else None
-            
-            file_responses.append(FileResponse(
-                **file_record.dict(),
-                download_url=download_url,
-                thumbnail_url=thumbnail_url,
-                preview_url=preview_url
-            ))
+        file_responses = [build_file_response(file_record) for file_record in files]
         
-        total_pages = (total + page_size - 1) // page_size
+        total_pages = (total + page_size - 1) // page_size if total is not None else None
         
-        return FileListResponse(
+        return FileListResponse.model_construct(
             files=file_responses,
             total=total,
             page=page,
@@ -222,21 +431,11 @@ async def get_file_list(
 
 @router.get("/{file_id}", response_model=FileResponse, summary="获取文件信息")
 async def get_file_info(
-    file_record: FileRecord = Depends(verify_file_access)
+    file_record: FileRecord = Depends(verify_file_access_cached)
 ):
     """获取文件信息"""
     try:
-        base_url = f"/files/{file_record.id}"
-        download_url = f"{base_url}/download"
-        thumbnail_url = f"{base_url}/thumbnail" if file_record.is_image else None
-        preview_url = f"{base_url}/preview" if file_record.is_image else None
-        
-        return FileResponse(
-            **file_record.dict(),
-            download_url=download_url,
-            thumbnail_url=thumbnail_url,
-            preview_url=preview_url
-        )
+        return build_file_response(file_record)
         
     except Exception as e:
         raise HTTPException(
@@ -247,51 +446,77 @@ async def get_file_info(
 
 @router.get("/{file_id}/download", summary="下载文件")
 async def download_file(
-    file_record: FileRecord = Depends(verify_file_access),
+    request: Request,
+    file_record: FileRecord = Depends(verify_file_access_cached),
     download: bool = Query(False, description="是否作为下载")
 ):
-    """下载或查看文件"""
+    """下载或查看文件
+
+    支持 Range 请求；除小文件缓存外，文件内容以流的方式分块返回。
+    """
     try:
         # 获取存储后端
         storage = storage_manager.get_storage_for_user(file_record.user)
         
-        # 尝试从缓存获取
-        cached_data = await cache_manager.get_file_cache(file_record.file_path)
+        # 设置响应头
+        headers = dict(download_headers(download, file_record.original_filename))
         
-        if cached_data:
-            file_data = cached_data
-        else:
-            # 从存储获取文件
-            file_data = await storage.get_file(file_record.file_path)
+        # 解析Range头，无效的范围按完整请求处理
+        file_size = file_record.file_size
+        range_header = request.headers.get("range")
+        byte_range = parse_range_header(range_header, file_size) if range_header else None
+        
+        file_data = None
+        if byte_range is None and file_size < FILE_CACHE_MAX_SIZE:
+            # 只有小文件才会进入缓存，大文件直接跳过缓存查询
+            file_data = await cache_manager.get_file_cache(file_record.file_path)
+            
             if file_data is None:
+                # 从存储获取文件并缓存
+                file_data = await storage.get_file(file_record.file_path)
+                if file_data is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="文件不存在"
+                    )
+                await cache_manager.set_file_cache(
+                    file_record.file_path, file_data, content_type=file_record.content_type
+                )
+        
+        if file_data is not None:
+            response = Response(content=file_data, media_type=file_record.content_type, headers=headers)
+        else:
+            # 大文件或范围请求，从存储分块读取
+            start, end = byte_range if byte_range else (0, file_size - 1)
+            file_stream = await storage.get_file_stream(
+                file_record.file_path, start, end if byte_range else None
+            )
+            if file_stream is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="文件不存在"
                 )
             
-            # 缓存文件（小于1MB的文件）
-            if len(file_data) < 1024 * 1024:
-                await cache_manager.set_file_cache(file_record.file_path, file_data)
+            headers["Content-Length"] = str(end - start + 1)
+            if byte_range:
+                headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            response = StreamingResponse(
+                file_stream,
+                status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+                media_type=file_record.content_type,
+                headers=headers
+            )
         
-        # 更新下载计数
-        await file_record.update(download_count=file_record.download_count + 1)
-        await cache_manager.increment_download_count(file_record.file_path)
+        # 更新下载计数，优先在Redis中累积，Redis不可用时在进程内累积，由后台任务批量写入数据库；
+        # 范围请求只有从头开始的那一次计数，避免分段下载和拖动播放重复计数
+        if byte_range is None or byte_range[0] == 0:
+            if not await cache_manager.record_download(file_record.id, file_record.file_path):
+                queue_download_count(file_record.id)
         
         # 记录访问日志
         # 这里简化处理，实际应该记录IP等信息
         
-        # 设置响应头
-        headers = {
-            "Content-Type": file_record.content_type,
-            "Content-Length": str(len(file_data))
-        }
-        
-        if download:
-            headers["Content-Disposition"] = f"attachment; filename={file_record.original_filename}"
-        else:
-            headers["Content-Disposition"] = f"inline; filename={file_record.original_filename}"
-        
-        return Response(content=file_data, headers=headers)
+        return response
         
     except HTTPException:
         raise
@@ -302,6 +527,64 @@ async def download_file(
         )
 
 
+async def serve_resized_image(file_record: FileRecord, size: Tuple[int, int], output_format: str,
+                              quality: int, cache_name: str, max_age: int) -> Response:
+    """返回缩放后的图片，缩略图和预览图共用
+
+    Args:
+        file_record: 已验证权限的文件记录
+        size: 目标尺寸 (width, height)
+        output_format: 输出格式
+        quality: 输出质量
+        cache_name: 缓存标识
+        max_age: 浏览器缓存时间（秒）
+    """
+    if not file_record.is_image:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="此文件不是图片"
+        )
+    
+    media_type = f"image/{output_format}"
+    headers = cache_control_headers(max_age)
+    
+    # 尝试从缓存获取
+    cached_image = await cache_manager.get_thumbnail_cache(cache_name, size)
+    if cached_image:
+        return Response(content=cached_image, media_type=media_type, headers=headers)
+    
+    storage = storage_manager.get_storage_for_user(file_record.user)
+    
+    # 常用尺寸优先读取上传时预生成的图片
+    if (size[0], size[1], output_format, quality) in CANONICAL_IMAGE_SIZES:
+        image_stream = await storage.get_file_stream(canonical_image_path(file_record.file_path, size, output_format))
+        if image_stream is not None:
+            return StreamingResponse(image_stream, media_type=media_type, headers=headers)
+    
+    # 获取原文件
+    file_data = await storage.get_file(file_record.file_path)
+    
+    if file_data is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="原文件不存在"
+        )
+    
+    # 生成缩放图片
+    image_data = await image_processor.resize_image(
+        file_data,
+        size,
+        keep_aspect_ratio=True,
+        output_format=output_format,
+        quality=quality
+    )
+    
+    # 缓存缩放图片
+    await cache_manager.set_thumbnail_cache(cache_name, size, image_data)
+    
+    return Response(content=image_data, media_type=media_type, headers=headers)
+
+
 @router.get("/{file_id}/thumbnail", summary="获取缩略图")
 async def get_thumbnail(
     file_id: int,
@@ -313,57 +596,11 @@ async def get_thumbnail(
     """获取文件缩略图"""
     try:
         # 验证文件访问权限
-        file_record = await verify_file_access(file_id, current_user)
-        
-        if not file_record.is_image:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="此文件不是图片"
-            )
-        
-        # 尝试从缓存获取缩略图
-        cached_thumbnail = await cache_manager.get_thumbnail_cache(
-            file_record.file_path, 
-            (width, height)
-        )
-        
-        if cached_thumbnail:
-            return Response(
-                content=cached_thumbnail,
-                media_type=f"image/{format}",
-                headers={"Cache-Control": "public, max-age=86400"}
-            )
-        
-        # 获取原文件
-        storage = storage_manager.get_storage_for_user(file_record.user)
-        file_data = await storage.get_file(file_record.file_path)
+        file_record = await verify_file_access_cached(file_id, current_user)
         
-        if file_data is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="原文件不存在"
-            )
-        
-        # 生成缩略图
-        thumbnail_data = await image_processor.resize_image(
-            file_data,
-            (width, height),
-            keep_aspect_ratio=True,
-            output_format=format,
-            quality=75
-        )
-        
-        # 缓存缩略图
-        await cache_manager.set_thumbnail_cache(
-            file_record.file_path,
-            (width, height),
-            thumbnail_data
-        )
-        
-        return Response(
-            content=thumbnail_data,
-            media_type=f"image/{format}",
-            headers={"Cache-Control": "public, max-age=86400"}
+        return await serve_resized_image(
+            file_record, (width, height), format,
+            quality=75, cache_name=file_record.file_path, max_age=86400
         )
         
     except HTTPException:
@@ -391,58 +628,11 @@ async def get_preview(
     """获取文件预览图"""
     try:
         # 验证文件访问权限
-        file_record = await verify_file_access(file_id, current_user)
+        file_record = await verify_file_access_cached(file_id, current_user)
         
-        if not file_record.is_image:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="此文件不是图片"
-            )
-        
-        # 尝试从缓存获取预览图
-        cache_key = f"preview:{file_record.file_path}:{width}x{height}:{format}"
-        cached_preview = await cache_manager.get_thumbnail_cache(
-            f"preview_{file_record.file_path}",
-            (width, height)
-        )
-        
-        if cached_preview:
-            return Response(
-                content=cached_preview,
-                media_type=f"image/{format}",
-                headers={"Cache-Control": "public, max-age=3600"}
-            )
-        
-        # 获取原文件
-        storage = storage_manager.get_storage_for_user(file_record.user)
-        file_data = await storage.get_file(file_record.file_path)
-        
-        if file_data is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="原文件不存在"
-            )
-        
-        # 生成预览图
-        preview_data = await image_processor.resize_image(
-            file_data,
-            (width, height),
-            keep_aspect_ratio=True,
-            output_format=format,
-            quality=85
-        )
-        
-        # 缓存预览图
-        await cache_manager.set_thumbnail_cache(
-            f"preview_{file_record.file_path}",
-            (width, height),
-            preview_data
-        )
-        
-        return Response(
-            content=preview_data,
-            media_type=f"image/{format}",
-            headers={"Cache-Control": "public, max-age=3600"}
+        return await serve_resized_image(
+            file_record, (width, height), format,
+            quality=85, cache_name=f"preview_{file_record.file_path}", max_age=3600
         )
         
     except HTTPException:
@@ -468,11 +658,7 @@ async def share_file(
     """创建文件分享链接"""
     try:
         # 验证文件所有权
-        file_record = await FileRecord.objects.filter(
-            id=file_id,
-            user=current_user.id,
-            status=FileStatus.ACTIVE
-        ).first()
+        file_record = await get_user_active_file(file_id, current_user.id)
         
         if not file_record:
             raise HTTPException(
@@ -489,10 +675,11 @@ async def share_file(
         
         # 更新文件记录
         expires_at = datetime.utcnow() + timedelta(hours=share_request.expires_in_hours)
-        await file_record.update(
-            access_token=access_token,
-            expires_at=expires_at
-        )
+        if not await update_file_record(file_id, access_token=access_token, expires_at=expires_at):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="更新文件记录失败"
+            )
         
         # 生成分享URL
         share_url = f"/files/{file_id}/download?token={access_token}"
@@ -520,11 +707,7 @@ async def delete_file(
     """删除文件"""
     try:
         # 验证文件所有权
-        file_record = await FileRecord.objects.filter(
-            id=file_id,
-            user=current_user.id,
-            status=FileStatus.ACTIVE
-        ).first()
+        file_record = await get_user_active_file(file_id, current_user.id)
         
         if not file_record:
             raise HTTPException(
@@ -535,12 +718,12 @@ async def delete_file(
         # 获取存储后端并删除文件
         storage = storage_manager.get_storage_for_user(current_user)
         await storage.delete_file(file_record.file_path)
+        if file_record.is_image:
+            for width, height, output_format, _ in CANONICAL_IMAGE_SIZES:
+                await storage.delete_file(canonical_image_path(file_record.file_path, (width, height), output_format))
         
         # 更新文件状态
-        await file_record.update(
-            status=FileStatus.DELETED,
-            updated_at=datetime.utcnow()
-        )
+        await delete_file_record(file_id, current_user.id, file_record.created_at)
         
         # 更新用户存储使用量
         await auth_manager.update_storage_usage(current_user, -file_record.file_size)
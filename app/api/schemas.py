@@ -6,7 +6,7 @@ from typing import Optional, List, Dict, Any
 
 from pydantic import BaseModel, Field, validator
 
-from app.models import StorageType, FileStatus
+from app.models import User, StorageType, FileStatus
 
 
 class UserBase(BaseModel):
@@ -48,6 +48,14 @@ class UserResponse(UserBase):
         from_attributes = True
 
 
+def to_user_response(user: User) -> UserResponse:
+    """从用户模型构建响应
+
+    剩余空间和使用百分比是 User 的属性，直接按属性读取，无需先转换为字典。
+    """
+    return UserResponse.model_validate(user, from_attributes=True)
+
+
 class UserLogin(BaseModel):
     """用户登录模式"""
     username: str = Field(..., description="用户名")
@@ -111,10 +119,23 @@ class FileResponse(BaseModel):
 class FileListResponse(BaseModel):
     """文件列表响应模式"""
     files: List[FileResponse]
-    total: int
+    total: Optional[int] = None  # 游标分页时不统计总数
     page: int
     page_size: int
-    total_pages: int
+    total_pages: Optional[int] = None
+
+
+class FileHashCheckRequest(BaseModel):
+    """文件哈希预检请求模式"""
+    file_hash: str = Field(..., max_length=64, description="文件哈希值，算法与服务端配置一致")
+    file_size: int = Field(..., ge=0, description="文件大小（字节）")
+
+
+class FileHashCheckResponse(BaseModel):
+    """文件哈希预检响应模式"""
+    exists: bool
+    hash_algorithm: str
+    file: Optional[FileResponse] = None
 
 
 class FileShareRequest(BaseModel):
@@ -3,24 +3,133 @@ Redis缓存模块
 提供文件缓存和缩略图缓存功能
 """
 import hashlib
-import json
-from typing import Optional, Any, Dict
+import os
+import time
+from functools import lru_cache
+from typing import Optional, Any, AsyncIterator, Dict, List, Tuple
 
+import orjson
 import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+try:
+    import zstandard
+except ImportError:  # 未安装时不压缩缓存值
+    zstandard = None
 
 from app.core.config import get_settings
 from app.core.logger import logger
 
 settings = get_settings()
 
+# 待写入数据库的下载计数哈希表
+PENDING_DOWNLOADS_KEY = "wpic:pending_downloads"
+
+# 已知文件哈希集合，成员格式为 "用户ID:文件哈希"
+FILE_HASHES_KEY = "wpic:file_hashes"
+# 集合加载完成标记，作为集合成员保存：集合被清空或淘汰时标记一并消失，未加载完成的集合不用于排除重复
+FILE_HASHES_READY_MEMBER = "__ready__"
+
+# 熔断：窗口时间内连接或超时错误达到阈值后，在一段时间内不再访问Redis，直接按缓存不可用处理
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_FAILURE_WINDOW = 10
+BREAKER_OPEN_SECONDS = 30
+
+# zstd帧头，压缩后的缓存值以此开头，未压缩的图片和JSON不会以此开头
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# 小于该大小的值不压缩
+COMPRESS_MIN_SIZE = 1024
+
+# 未经压缩的图片格式，其余常见图片格式本身已压缩，再压缩收益很小
+COMPRESSIBLE_CONTENT_TYPES = frozenset({"image/bmp", "image/x-ms-bmp", "image/tiff", "image/svg+xml", "image/x-icon"})
+
+_compressor = zstandard.ZstdCompressor(level=3) if zstandard else None
+_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+
+def compress_value(data: bytes) -> bytes:
+    """压缩缓存值，值较小、压缩无收益或未安装zstandard时原样返回"""
+    if _compressor is None or len(data) < COMPRESS_MIN_SIZE:
+        return data
+    compressed = _compressor.compress(data)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress_value(data: bytes) -> bytes:
+    """解压缓存值，未压缩的值原样返回"""
+    if data.startswith(ZSTD_MAGIC) and _decompressor is not None:
+        return _decompressor.decompress(data)
+    return data
+
+
+@lru_cache(maxsize=16384)
+def identifier_digest(identifier: str) -> str:
+    """标识符的BLAKE2b摘要，确保键名不会太长
+
+    同一文件路径会用于文件、元数据、缩略图、计数等多种键，摘要按标识符缓存，各前缀共用。
+    """
+    return hashlib.blake2b(identifier.encode(), digest_size=12).hexdigest()
+
+
+def build_cache_key(prefix: str, identifier: str) -> str:
+    """生成缓存键"""
+    return f"wpic:{prefix}:{identifier_digest(identifier)}"
+
+
+def dump_json(value: Any) -> bytes:
+    """将缓存值序列化为JSON字节，非字符串键和无法直接序列化的值转为字符串"""
+    return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+# 自增计数，首次创建时设置过期时间，一次往返完成且不会遗留没有过期时间的键
+INCR_WITH_TTL_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
 
 class CacheManager:
     """缓存管理器"""
     
     def __init__(self):
         """初始化缓存管理器"""
-        self.redis_client: Optional[redis.Redis] = None
+        self._client: Optional[redis.Redis] = None
+        self._pool: Optional[redis.BlockingConnectionPool] = None
         self._connected = False
+        self._incr_script = None
+        
+        # 熔断状态
+        self._failures = 0
+        self._failure_window_start = 0.0
+        self._breaker_open_until = 0.0
+    
+    @property
+    def redis_client(self) -> Optional[redis.Redis]:
+        """Redis客户端，未连接或熔断期间为None，各缓存操作据此直接跳过"""
+        if self._breaker_open_until and time.monotonic() < self._breaker_open_until:
+            return None
+        return self._client
+    
+    def _record_failure(self, error: Exception):
+        """记录Redis连接或超时错误，短时间内错误过多时打开熔断"""
+        if not isinstance(error, (RedisConnectionError, RedisTimeoutError)):
+            return
+        
+        now = time.monotonic()
+        if now - self._failure_window_start > BREAKER_FAILURE_WINDOW:
+            self._failure_window_start = now
+            self._failures = 0
+        self._failures += 1
+        if self._failures >= BREAKER_FAILURE_THRESHOLD:
+            self._breaker_open_until = now + BREAKER_OPEN_SECONDS
+            self._failures = 0
+            logger.error(f"Redis连续出错，{BREAKER_OPEN_SECONDS}秒内暂停使用缓存")
     
     async def connect(self):
         """连接到Redis"""
@@ -28,31 +137,44 @@ class CacheManager:
             return
         
         try:
-            self.redis_client = redis.Redis(
+            # redis-py 不会把并发命令合并到同一连接上，每个进行中的命令独占一个连接，
+            # 使用有上限的连接池让并发请求的命令并行执行，连接用尽时等待而不是报错
+            self._pool = redis.BlockingConnectionPool(
                 host=settings.redis.host,
                 port=settings.redis.port,
                 password=settings.redis.password,
                 db=settings.redis.db,
+                max_connections=settings.redis.max_connections,
+                timeout=5,
                 decode_responses=False,  # 保持二进制数据
                 socket_connect_timeout=5,
-                socket_timeout=5,
-                retry_on_timeout=True
+                # 本地Redis操作通常在毫秒内完成，超时设短并只做少量退避重试，Redis卡住时尽快失败
+                socket_timeout=1,
+                retry=Retry(ExponentialBackoff(cap=1, base=0.05), 2)
             )
+            self._client = redis.Redis(connection_pool=self._pool)
             
             # 测试连接
-            await self.redis_client.ping()
+            await self._client.ping()
+            self._incr_script = self._client.register_script(INCR_WITH_TTL_SCRIPT)
             self._connected = True
             
         except Exception as e:
             logger.error(f"Redis连接失败: {str(e)}")
-            self.redis_client = None
+            if self._pool:
+                await self._pool.disconnect()
+            self._client = None
+            self._pool = None
             self._connected = False
     
     async def disconnect(self):
         """断开Redis连接"""
-        if self.redis_client:
-            await self.redis_client.close()
-            self.redis_client = None
+        if self._client:
+            await self._client.close()
+            await self._pool.disconnect()
+            self._client = None
+            self._pool = None
+            self._incr_script = None
             self._connected = False
     
     def _generate_cache_key(self, prefix: str, identifier: str) -> str:
@@ -65,17 +187,57 @@ class CacheManager:
         Returns:
             str: 缓存键
         """
-        # 使用MD5哈希确保键名不会太长
-        hash_obj = hashlib.md5(identifier.encode())
-        return f"wpic:{prefix}:{hash_obj.hexdigest()}"
+        return build_cache_key(prefix, identifier)
+    
+    def _thumbnail_key_prefix(self, file_path: str) -> str:
+        """生成文件缩略图缓存键前缀，同一文件的所有尺寸共用该前缀"""
+        return self._generate_cache_key("thumb", file_path)
+    
+    def _thumbnail_index_key(self, file_path: str) -> str:
+        """生成记录文件全部缩略图缓存键的集合键，清除时无需SCAN整个键空间"""
+        return self._generate_cache_key("thumbs", file_path)
     
-    async def set_file_cache(self, file_path: str, file_data: bytes, ttl: int = 3600) -> bool:
+    async def _iter_key_batches(self, pattern: str, count: int = 1000) -> AsyncIterator[List[bytes]]:
+        """使用SCAN增量遍历匹配的键，每次返回一批
+        
+        使用SCAN代替KEYS，避免在键很多时阻塞Redis，也不需要一次性取回所有匹配的键；
+        COUNT远大于默认的10，每次往返可以检查约count个键。
+        
+        Args:
+            pattern: 键匹配模式
+            count: 每次SCAN检查的键数量提示
+        """
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis_client.scan(cursor=cursor, match=pattern, count=count)
+            if keys:
+                yield keys
+            if cursor == 0:
+                break
+    
+    async def _delete_matching(self, pattern: str) -> int:
+        """增量扫描并分批删除匹配的键
+        
+        Args:
+            pattern: 键匹配模式
+            
+        Returns:
+            int: 删除的键数量
+        """
+        deleted = 0
+        async for keys in self._iter_key_batches(pattern):
+            deleted += await self.redis_client.delete(*keys)
+        return deleted
+    
+    async def set_file_cache(self, file_path: str, file_data: bytes, ttl: int = 3600,
+                             content_type: Optional[str] = None) -> bool:
         """设置文件缓存
         
         Args:
             file_path: 文件路径
             file_data: 文件数据
             ttl: 过期时间（秒），默认1小时
+            content_type: 文件类型，未压缩的图片格式会压缩后缓存
             
         Returns:
             bool: 设置是否成功
@@ -85,10 +247,13 @@ class CacheManager:
         
         try:
             cache_key = self._generate_cache_key("file", file_path)
+            if content_type in COMPRESSIBLE_CONTENT_TYPES:
+                file_data = compress_value(file_data)
             await self.redis_client.setex(cache_key, ttl, file_data)
             return True
         except Exception as e:
-            logger.error(f"设置文件缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"设置文件缓存失败: {str(e)}")
             return False
     
     async def get_file_cache(self, file_path: str) -> Optional[bytes]:
@@ -105,9 +270,11 @@ class CacheManager:
         
         try:
             cache_key = self._generate_cache_key("file", file_path)
-            return await self.redis_client.get(cache_key)
+            file_data = await self.redis_client.get(cache_key)
+            return decompress_value(file_data) if file_data else file_data
         except Exception as e:
-            logger.error(f"获取文件缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"获取文件缓存失败: {str(e)}")
             return None
     
     async def set_thumbnail_cache(self, file_path: str, size: tuple, thumbnail_data: bytes, ttl: int = 7200) -> bool:
@@ -126,11 +293,17 @@ class CacheManager:
             return False
         
         try:
-            cache_key = self._generate_cache_key("thumb", f"{file_path}:{size[0]}x{size[1]}")
-            await self.redis_client.setex(cache_key, ttl, thumbnail_data)
+            cache_key = f"{self._thumbnail_key_prefix(file_path)}:{size[0]}x{size[1]}"
+            index_key = self._thumbnail_index_key(file_path)
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.setex(cache_key, ttl, thumbnail_data)
+                pipe.sadd(index_key, cache_key)
+                pipe.expire(index_key, ttl)
+                await pipe.execute()
             return True
         except Exception as e:
-            logger.error(f"设置缩略图缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"设置缩略图缓存失败: {str(e)}")
             return False
     
     async def get_thumbnail_cache(self, file_path: str, size: tuple) -> Optional[bytes]:
@@ -147,10 +320,11 @@ class CacheManager:
             return None
         
         try:
-            cache_key = self._generate_cache_key("thumb", f"{file_path}:{size[0]}x{size[1]}")
+            cache_key = f"{self._thumbnail_key_prefix(file_path)}:{size[0]}x{size[1]}"
             return await self.redis_client.get(cache_key)
         except Exception as e:
-            logger.error(f"获取缩略图缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"获取缩略图缓存失败: {str(e)}")
             return None
     
     async def set_metadata_cache(self, file_path: str, metadata: Dict[str, Any], ttl: int = 3600) -> bool:
@@ -170,11 +344,12 @@ class CacheManager:
         try:
             cache_key = self._generate_cache_key("meta", file_path)
             # 序列化元数据
-            metadata_json = json.dumps(metadata, ensure_ascii=False, default=str)
+            metadata_json = compress_value(dump_json(metadata))
             await self.redis_client.setex(cache_key, ttl, metadata_json)
             return True
         except Exception as e:
-            logger.error(f"设置元数据缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"设置元数据缓存失败: {str(e)}")
             return False
     
     async def get_metadata_cache(self, file_path: str) -> Optional[Dict[str, Any]]:
@@ -193,12 +368,154 @@ class CacheManager:
             cache_key = self._generate_cache_key("meta", file_path)
             metadata_json = await self.redis_client.get(cache_key)
             if metadata_json:
-                return json.loads(metadata_json.decode())
+                return orjson.loads(decompress_value(metadata_json))
+            return None
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"获取元数据缓存失败: {str(e)}")
+            return None
+    
+    async def set_stats_cache(self, name: str, stats: Dict[str, Any], ttl: int = 30) -> bool:
+        """设置统计数据缓存
+        
+        Args:
+            name: 统计项名称，如 system、user:1
+            stats: 统计数据
+            ttl: 过期时间（秒），默认30秒
+            
+        Returns:
+            bool: 设置是否成功
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            cache_key = self._generate_cache_key("stats", name)
+            stats_json = dump_json(stats)
+            await self.redis_client.setex(cache_key, ttl, stats_json)
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"设置统计缓存失败: {str(e)}")
+            return False
+    
+    async def get_stats_cache(self, name: str) -> Optional[Dict[str, Any]]:
+        """获取统计数据缓存
+        
+        Args:
+            name: 统计项名称
+            
+        Returns:
+            Optional[Dict[str, Any]]: 缓存的统计数据，不存在时返回None
+        """
+        if not self.redis_client:
+            return None
+        
+        try:
+            cache_key = self._generate_cache_key("stats", name)
+            stats_json = await self.redis_client.get(cache_key)
+            if stats_json:
+                return orjson.loads(stats_json)
             return None
         except Exception as e:
-            logger.error(f"获取元数据缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"获取统计缓存失败: {str(e)}")
             return None
     
+    async def delete_stats_cache(self, *names: str) -> bool:
+        """删除统计数据缓存
+        
+        Args:
+            names: 统计项名称
+            
+        Returns:
+            bool: 删除是否成功
+        """
+        if not self.redis_client or not names:
+            return False
+        
+        try:
+            cache_keys = [self._generate_cache_key("stats", name) for name in names]
+            await self.redis_client.delete(*cache_keys)
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"删除统计缓存失败: {str(e)}")
+            return False
+    
+    async def set_file_access_cache(self, file_id: int, user_id: Optional[int],
+                                    entry: Dict[str, Any], ttl: int = 30) -> bool:
+        """设置文件访问权限缓存
+        
+        同一文件的权限结果存放在一个哈希表中，字段为用户ID（匿名访问为0），便于文件变更时整体清除。
+        
+        Args:
+            file_id: 文件ID
+            user_id: 用户ID，匿名访问时为None
+            entry: 权限验证结果
+            ttl: 过期时间（秒），默认30秒
+            
+        Returns:
+            bool: 设置是否成功
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            cache_key = f"wpic:acl:{file_id}"
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(cache_key, str(user_id or 0), dump_json(entry))
+                pipe.expire(cache_key, ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"设置权限缓存失败: {str(e)}")
+            return False
+    
+    async def get_file_access_cache(self, file_id: int, user_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """获取文件访问权限缓存
+        
+        Args:
+            file_id: 文件ID
+            user_id: 用户ID，匿名访问时为None
+            
+        Returns:
+            Optional[Dict[str, Any]]: 缓存的权限验证结果，不存在时返回None
+        """
+        if not self.redis_client:
+            return None
+        
+        try:
+            entry_json = await self.redis_client.hget(f"wpic:acl:{file_id}", str(user_id or 0))
+            if entry_json:
+                return orjson.loads(entry_json)
+            return None
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"获取权限缓存失败: {str(e)}")
+            return None
+    
+    async def delete_file_access_cache(self, file_id: int) -> bool:
+        """删除文件的全部访问权限缓存
+        
+        Args:
+            file_id: 文件ID
+            
+        Returns:
+            bool: 删除是否成功
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            await self.redis_client.delete(f"wpic:acl:{file_id}")
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"删除权限缓存失败: {str(e)}")
+            return False
+    
     async def delete_file_cache(self, file_path: str) -> bool:
         """删除文件相关的所有缓存
         
@@ -212,23 +529,17 @@ class CacheManager:
             return False
         
         try:
-            # 删除文件缓存
+            # 从索引集合取出缩略图缓存键，再用一条 DEL 删除全部相关键，共两次往返，不需要SCAN
             file_key = self._generate_cache_key("file", file_path)
-            await self.redis_client.delete(file_key)
-            
-            # 删除元数据缓存
             meta_key = self._generate_cache_key("meta", file_path)
-            await self.redis_client.delete(meta_key)
-            
-            # 删除相关的缩略图缓存（通过模式匹配）
-            thumb_pattern = self._generate_cache_key("thumb", f"{file_path}:*")
-            thumb_keys = await self.redis_client.keys(thumb_pattern)
-            if thumb_keys:
-                await self.redis_client.delete(*thumb_keys)
+            index_key = self._thumbnail_index_key(file_path)
+            thumb_keys = await self.redis_client.smembers(index_key)
             
+            await self.redis_client.delete(file_key, meta_key, index_key, *thumb_keys)
             return True
         except Exception as e:
-            logger.error(f"删除文件缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"删除文件缓存失败: {str(e)}")
             return False
     
     async def set_user_session(self, session_id: str, user_data: Dict[str, Any], ttl: int = 86400) -> bool:
@@ -247,11 +558,12 @@ class CacheManager:
         
         try:
             cache_key = self._generate_cache_key("session", session_id)
-            user_json = json.dumps(user_data, ensure_ascii=False, default=str)
+            user_json = compress_value(dump_json(user_data))
             await self.redis_client.setex(cache_key, ttl, user_json)
             return True
         except Exception as e:
-            logger.error(f"设置会话缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"设置会话缓存失败: {str(e)}")
             return False
     
     async def get_user_session(self, session_id: str) -> Optional[Dict[str, Any]]:
@@ -270,10 +582,11 @@ class CacheManager:
             cache_key = self._generate_cache_key("session", session_id)
             user_json = await self.redis_client.get(cache_key)
             if user_json:
-                return json.loads(user_json.decode())
+                return orjson.loads(decompress_value(user_json))
             return None
         except Exception as e:
-            logger.error(f"获取会话缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"获取会话缓存失败: {str(e)}")
             return None
     
     async def delete_user_session(self, session_id: str) -> bool:
@@ -293,7 +606,8 @@ class CacheManager:
             await self.redis_client.delete(cache_key)
             return True
         except Exception as e:
-            logger.error(f"删除会话缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"删除会话缓存失败: {str(e)}")
             return False
     
     async def increment_download_count(self, file_path: str, ttl: int = 86400) -> int:
@@ -311,13 +625,10 @@ class CacheManager:
         
         try:
             cache_key = self._generate_cache_key("count", file_path)
-            count = await self.redis_client.incr(cache_key)
-            # 设置过期时间（只在第一次时设置）
-            if count == 1:
-                await self.redis_client.expire(cache_key, ttl)
-            return count
+            return int(await self._incr_script(keys=[cache_key], args=[ttl]))
         except Exception as e:
-            logger.error(f"增加下载计数失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"增加下载计数失败: {str(e)}")
             return 0
     
     async def get_download_count(self, file_path: str) -> int:
@@ -337,9 +648,156 @@ class CacheManager:
             count = await self.redis_client.get(cache_key)
             return int(count) if count else 0
         except Exception as e:
-            logger.error(f"获取下载计数失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"获取下载计数失败: {str(e)}")
             return 0
     
+    async def acquire_lock(self, name: str, ttl: int) -> Optional[bool]:
+        """获取多进程共享的互斥锁（SET NX），到期自动释放
+        
+        Args:
+            name: 锁名称
+            ttl: 锁的有效期（秒）
+            
+        Returns:
+            Optional[bool]: 是否获得锁，Redis不可用时返回None，由调用方决定是否继续
+        """
+        if not self.redis_client:
+            return None
+        
+        try:
+            return bool(await self.redis_client.set(f"wpic:lock:{name}", os.getpid(), nx=True, ex=ttl))
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"获取锁失败: {str(e)}")
+            return None
+    
+    async def record_download(self, file_id: int, file_path: str, ttl: int = 86400) -> bool:
+        """记录一次下载：累积待写入数据库的下载计数，并增加文件的短期下载计数
+        
+        两条命令在一个非事务管道中发送，只需一次往返。
+        
+        Args:
+            file_id: 文件ID
+            file_path: 文件路径
+            ttl: 短期下载计数的过期时间（秒），默认24小时
+            
+        Returns:
+            bool: 是否记录成功，Redis不可用时返回False
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hincrby(PENDING_DOWNLOADS_KEY, str(file_id), 1)
+                await self._incr_script(keys=[self._generate_cache_key("count", file_path)], args=[ttl], client=pipe)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"记录下载失败: {str(e)}")
+            return False
+    
+    async def pop_pending_downloads(self) -> Dict[int, int]:
+        """取出并清空累积的下载计数
+        
+        Returns:
+            Dict[int, int]: 文件ID到下载次数增量的映射
+        """
+        if not self.redis_client:
+            return {}
+        
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.hgetall(PENDING_DOWNLOADS_KEY)
+                pipe.delete(PENDING_DOWNLOADS_KEY)
+                pending, _ = await pipe.execute()
+            return {int(file_id): int(count) for file_id, count in pending.items()}
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"获取累积下载计数失败: {str(e)}")
+            return {}
+    
+    async def add_file_hash(self, user_id: int, file_hash: str) -> bool:
+        """记录用户已上传的文件哈希
+        
+        Args:
+            user_id: 用户ID
+            file_hash: 文件哈希
+            
+        Returns:
+            bool: 记录是否成功
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            await self.redis_client.sadd(FILE_HASHES_KEY, f"{user_id}:{file_hash}")
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"记录文件哈希失败: {str(e)}")
+            return False
+    
+    async def has_file_hash(self, user_id: int, file_hash: str) -> Optional[bool]:
+        """检查用户是否上传过该哈希的文件
+        
+        集合只增不减，命中时仍需查询数据库确认；集合加载完成后未命中可确定文件不存在。
+        集合尚未加载完成（启动重建前、Redis数据被清空后）时无法判断，返回None，由调用方查询数据库。
+        
+        Args:
+            user_id: 用户ID
+            file_hash: 文件哈希
+            
+        Returns:
+            Optional[bool]: 是否存在，Redis不可用或集合未加载完成时返回None
+        """
+        if not self.redis_client:
+            return None
+        
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.sismember(FILE_HASHES_KEY, f"{user_id}:{file_hash}")
+                pipe.sismember(FILE_HASHES_KEY, FILE_HASHES_READY_MEMBER)
+                exists, ready = await pipe.execute()
+            if exists:
+                return True
+            return False if ready else None
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"检查文件哈希失败: {str(e)}")
+            return None
+    
+    async def rebuild_file_hashes(self, file_hashes: List[Tuple[int, str]], batch_size: int = 10000) -> bool:
+        """把数据库中的有效文件哈希加入文件哈希集合
+        
+        只添加不删除，不会清掉并发上传刚加入的哈希；已删除文件的哈希留在集合中，
+        只会让检查多查一次数据库。全部写入后加入加载完成标记。
+        
+        Args:
+            file_hashes: (用户ID, 文件哈希) 列表
+            batch_size: 每批写入数量
+            
+        Returns:
+            bool: 重建是否成功
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            members = [f"{user_id}:{file_hash}" for user_id, file_hash in file_hashes]
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for i in range(0, len(members), batch_size):
+                    pipe.sadd(FILE_HASHES_KEY, *members[i:i + batch_size])
+                pipe.sadd(FILE_HASHES_KEY, FILE_HASHES_READY_MEMBER)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._record_failure(e)
+            logger.warning(f"重建文件哈希集合失败: {str(e)}")
+            return False
+    
     async def clear_all_cache(self) -> bool:
         """清除所有缓存（慎用）
         
@@ -350,12 +808,11 @@ class CacheManager:
             return False
         
         try:
-            keys = await self.redis_client.keys("wpic:*")
-            if keys:
-                await self.redis_client.delete(*keys)
+            await self._delete_matching("wpic:*")
             return True
         except Exception as e:
-            logger.error(f"清除所有缓存失败: {str(e)}")
+            self._record_failure(e)
+            logger.warning(f"清除所有缓存失败: {str(e)}")
             return False
 
 
@@ -2,6 +2,8 @@
 配置管理模块
 支持从环境变量和配置文件加载设置
 """
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -17,6 +19,7 @@ class DatabaseConfig(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="DB_", 
         extra="ignore",
+        frozen=True,
         env_file=str(PROJECT_ROOT / ".env"),
         env_file_encoding="utf-8"
     )
@@ -25,6 +28,9 @@ class DatabaseConfig(BaseSettings):
         default="sqlite:///./wpic.db",
         description="数据库连接URL"
     )
+    pool_size: int = Field(default=20, description="连接池常驻连接数（SQLite不使用）")
+    max_overflow: int = Field(default=10, description="连接池允许超出的连接数（SQLite不使用）")
+    pool_recycle: int = Field(default=1800, description="连接回收时间（秒），避免使用被服务端关闭的连接")
 
 
 class RedisConfig(BaseSettings):
@@ -32,6 +38,7 @@ class RedisConfig(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="REDIS_", 
         extra="ignore",
+        frozen=True,
         env_file=str(PROJECT_ROOT / ".env"),
         env_file_encoding="utf-8"
     )
@@ -40,6 +47,7 @@ class RedisConfig(BaseSettings):
     port: int = Field(default=6379, description="Redis端口")
     password: Optional[str] = Field(default=None, description="Redis密码")
     db: int = Field(default=0, description="Redis数据库号")
+    max_connections: int = Field(default=64, description="连接池最大连接数，连接用尽时等待空闲连接")
 
 
 class StorageConfig(BaseSettings):
@@ -47,6 +55,7 @@ class StorageConfig(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="STORAGE_", 
         extra="ignore",
+        frozen=True,
         env_file=str(PROJECT_ROOT / ".env"),
         env_file_encoding="utf-8"
     )
@@ -72,6 +81,7 @@ class SecurityConfig(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="SECURITY_", 
         extra="ignore",
+        frozen=True,
         env_file=str(PROJECT_ROOT / ".env"),
         env_file_encoding="utf-8"
     )
@@ -90,6 +100,7 @@ class AppConfig(BaseSettings):
     model_config = SettingsConfigDict(
         env_prefix="APP_", 
         extra="ignore",
+        frozen=True,
         env_file=str(PROJECT_ROOT / ".env"),
         env_file_encoding="utf-8"
     )
@@ -105,6 +116,11 @@ class AppConfig(BaseSettings):
     
     # 文件上传配置
     max_file_size: int = Field(default=10 * 1024 * 1024, description="最大文件大小(字节)")  # 10MB
+    max_concurrent_uploads: int = Field(
+        default_factory=lambda: (os.cpu_count() or 2) * 2,
+        description="同时处理的最大上传数"
+    )
+    max_queued_uploads: int = Field(default=100, description="等待处理的最大上传数，超出时返回503")
     allowed_extensions: list = Field(
         default=[".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".bmp", ".tiff"],
         description="允许的文件扩展名"
@@ -116,6 +132,7 @@ class AppConfig(BaseSettings):
     
     # 文件管理
     auto_rename: bool = Field(default=True, description="是否自动重命名文件")
+    hash_algorithm: str = Field(default="md5", description="文件哈希算法(md5/sha256/blake3)，已有文件按md5去重，切换后旧文件无法命中")
 
 
 class Settings(BaseSettings):
@@ -124,31 +141,25 @@ class Settings(BaseSettings):
         env_file=str(PROJECT_ROOT / ".env"),
         env_file_encoding="utf-8",
         case_sensitive=False,
-        extra="ignore"
+        extra="ignore",
+        frozen=True
     )
     
-    # 各模块配置
-    app: AppConfig = AppConfig()
-    database: DatabaseConfig = DatabaseConfig()
-    redis: RedisConfig = RedisConfig()
-    storage: StorageConfig = StorageConfig()
-    security: SecurityConfig = SecurityConfig()
-
-
-# 全局设置实例 - 使用懒加载避免缓存问题
-_settings: Optional[Settings] = None
+    # 各模块配置，创建 Settings 时才读取环境变量，重新加载配置时也会重新读取
+    app: AppConfig = Field(default_factory=AppConfig)
+    database: DatabaseConfig = Field(default_factory=DatabaseConfig)
+    redis: RedisConfig = Field(default_factory=RedisConfig)
+    storage: StorageConfig = Field(default_factory=StorageConfig)
+    security: SecurityConfig = Field(default_factory=SecurityConfig)
 
 
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
-    """获取设置实例"""
-    global _settings
-    if _settings is None:
-        _settings = Settings()
-    return _settings
+    """获取设置实例，首次调用时加载，之后返回同一个只读实例"""
+    return Settings()
 
 
 def reload_settings():
     """重新加载配置"""
-    global _settings
-    _settings = None
+    get_settings.cache_clear()
     return get_settings()
@@ -1,49 +1,109 @@
 """
 数据库连接和初始化模块
 """
-from typing import Dict, Any, Optional, Generator
+import threading
+from typing import Dict, Any, Optional, AsyncGenerator
 
-from sqlalchemy import Engine
-from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import URL, event, inspect, make_url, text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.core.config import get_settings
 from app.core.logger import logger
 
-# 延迟初始化，避免在导入时就获取配置
-_engine: Optional[Engine] = None
-_async_engine = None
+# 同步驱动到对应异步驱动的映射，配置中仍可使用常规的数据库URL
+ASYNC_DRIVERS = {
+    "pysqlite": "sqlite+aiosqlite",
+    "psycopg2": "postgresql+asyncpg",
+    "mysqldb": "mysql+aiomysql",
+    "pymysql": "mysql+aiomysql",
+}
 
+# 已被新索引取代的旧索引：表名 -> 索引名，启动时从已有数据库中删除
+OBSOLETE_INDEXES = {
+    # 被 ix_wpic_file_records_user_status_created_id 取代
+    "wpic_file_records": ("ix_wpic_file_records_user_status_created",),
+}
 
-def get_engine() -> Engine:
-    """获取SQLAlchemy引擎实例"""
-    global _engine
-    if _engine is None:
+# 延迟初始化，避免在导入时就获取配置
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker] = None
+_engine_lock = threading.Lock()
+
+
+def get_async_database_url(database_url: str) -> URL:
+    """把数据库URL转换为使用异步驱动的URL，已指定异步驱动时保持不变"""
+    url = make_url(database_url)
+    async_drivername = ASYNC_DRIVERS.get(url.get_driver_name())
+    if async_drivername:
+        url = url.set(drivername=async_drivername)
+    return url
+
+
+def get_engine() -> AsyncEngine:
+    """获取异步SQLAlchemy引擎实例，并发调用时也只创建一个引擎"""
+    global _engine, _session_factory
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
         settings = get_settings()
-        # 为SQLite添加额外选项
+        database_url = get_async_database_url(settings.database.database_url)
+        backend = database_url.get_backend_name()
         engine_options: Dict[str, Any] = {"echo": settings.app.debug}
-        if settings.database.database_url.startswith('sqlite'):
-            engine_options["connect_args"] = {"check_same_thread": False}
-        _engine = create_engine(settings.database.database_url, **engine_options)
+        if backend != "sqlite":
+            # 服务端数据库使用较大的连接池，取用前检测连接是否可用，并定期回收
+            engine_options.update(
+                pool_size=settings.database.pool_size,
+                max_overflow=settings.database.max_overflow,
+                pool_pre_ping=True,
+                pool_recycle=settings.database.pool_recycle,
+                pool_use_lifo=True
+            )
+            if backend == "mysql":
+                engine_options["connect_args"] = {"charset": "utf8mb4"}
+        engine = create_async_engine(database_url, **engine_options)
+        if backend == "sqlite":
+            event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+        # 提交后不过期属性，会话关闭后返回的对象仍可直接读取
+        _session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        _engine = engine
     return _engine
 
 
-def get_session() -> Generator[Session, None, None]:
-    """获取数据库会话"""
-    engine = get_engine()
-    with Session(engine) as session:
-        yield session
+def get_session_factory() -> async_sessionmaker:
+    """获取异步会话工厂"""
+    get_engine()
+    return _session_factory
+
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite连接建立时设置性能相关参数
 
-# 获取实例
-engine = get_engine()
+    WAL模式允许读写并发，NORMAL同步级别在WAL模式下仍然安全。
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    """获取数据库会话"""
+    async with get_session_factory()() as session:
+        yield session
 
 
 # 初始化数据库连接
 async def init_database():
     """初始化数据库连接"""
     try:
-        # SQLModel 不需要异步连接初始化，只需要确保引擎存在
-        engine = get_engine()
+        get_engine()
         logger.info("✅ 数据库连接成功")
     except Exception as e:
         logger.error(f"❌ 数据库连接失败: {e}")
@@ -51,9 +111,10 @@ async def init_database():
 
 # 关闭数据库连接
 async def close_database():
-    """关闭数据库连接"""
+    """关闭数据库连接，释放连接池"""
     try:
-        # SQLModel 会自动管理连接
+        if _engine is not None:
+            await _engine.dispose()
         logger.info("✅ 数据库连接已关闭")
     except Exception as e:
         logger.error(f"❌ 关闭数据库连接失败: {e}")
@@ -64,15 +125,68 @@ async def create_all_tables():
     """创建所有数据库表"""
     try:
         # 导入所有模型以确保它们被注册
-        from app.models import User, FileRecord, UploadSession, AccessLog
+        from app.models import User, FileRecord, UploadSession, AccessLog, StatsCounter
         
-        # 使用SQLModel创建所有表
-        SQLModel.metadata.create_all(engine)
+        # 使用SQLModel创建所有表，DDL在异步连接的同步视图上执行
+        async with get_engine().begin() as connection:
+            await connection.run_sync(_create_tables_and_indexes)
         logger.info("✅ 数据库表创建完成")
     except Exception as e:
         logger.error(f"❌ 创建数据库表失败: {e}")
 
 
+def _create_tables_and_indexes(connection):
+    """创建所有表，并补建已存在表上缺少的索引"""
+    SQLModel.metadata.create_all(connection)
+    _migrate_storage_config_column(connection)
+    
+    # create_all 不会为已存在的表补建新增索引，逐个检查创建
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    
+    _drop_obsolete_indexes(connection)
+
+
+def _migrate_storage_config_column(connection):
+    """PostgreSQL 下把旧版本文本类型的 wpic_users.storage_config 转换为 JSONB
+
+    create_all 不会修改已存在的列，需在创建 GIN 索引之前完成转换；
+    SQLite 和 MySQL 中已有的JSON文本可直接按JSON类型读取，无需转换。
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    inspector = inspect(connection)
+    if not inspector.has_table("wpic_users"):
+        return
+    column = next((c for c in inspector.get_columns("wpic_users") if c["name"] == "storage_config"), None)
+    if column is None or column["type"].__class__.__name__.upper() == "JSONB":
+        return
+    connection.execute(text(
+        "ALTER TABLE wpic_users ALTER COLUMN storage_config TYPE jsonb "
+        "USING COALESCE(NULLIF(storage_config::text, ''), '{}')::jsonb"
+    ))
+    logger.info("🔄 已将 wpic_users.storage_config 转换为 JSONB")
+
+
+def _drop_obsolete_indexes(connection):
+    """删除已被取代的旧索引，避免写入时继续维护无用的索引"""
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table_name, index_names in OBSOLETE_INDEXES.items():
+        if not inspector.has_table(table_name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        for index_name in index_names:
+            if index_name not in existing:
+                continue
+            statement = f"DROP INDEX {preparer.quote(index_name)}"
+            if connection.dialect.name in ("mysql", "mariadb"):
+                statement += f" ON {preparer.quote(table_name)}"
+            connection.execute(text(statement))
+            logger.info(f"🗑️ 已删除旧索引 {index_name}")
+
+
 async def create_default_admin():
     """创建默认管理员用户"""
     try:
@@ -80,15 +194,14 @@ async def create_default_admin():
         from app.core.security import get_auth_manager
         
         # 使用SQLModel会话
-        with Session(engine) as session:
+        async with get_session_factory()() as session:
             # 检查是否已存在admin用户
-            from sqlmodel import select
-            statement = select(User).where(User.username == "admin")
-            existing_user = session.exec(statement).first()
+            statement = select(User.id).where(User.username == "admin").limit(1)
+            existing_user_id = (await session.exec(statement)).first()
             
-            if existing_user is None:
+            if existing_user_id is None:
                 auth_manager = get_auth_manager()
-                password_hash = auth_manager.get_password_hash("123456")
+                password_hash = await auth_manager.get_password_hash("123456")
                 
                 # 创建用户，SQLModel会自动应用默认值
                 admin_user = User(
@@ -99,7 +212,7 @@ async def create_default_admin():
                 )
                 
                 session.add(admin_user)
-                session.commit()
+                await session.commit()
                 logger.info("✅ 默认管理员用户 'admin' 创建成功，密码: 123456")
             else:
                 logger.debug("⚠️ 管理员用户 'admin' 已存在，跳过创建")
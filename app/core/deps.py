@@ -9,7 +9,7 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from app.core.cache import get_cache_manager
 from app.core.config import get_settings
-from app.core.security import get_auth_manager
+from app.core.security import ADMIN_USER_ID, get_auth_manager
 from app.models import User, FileRecord
 from app.services.image_service import get_image_processor
 from app.services.storage_service import get_storage_manager
@@ -18,7 +18,7 @@ settings = get_settings()
 security = HTTPBearer(auto_error=False)
 
 
-def get_current_user_optional(
+async def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> Optional[User]:
     """获取当前用户（可选）"""
@@ -31,29 +31,36 @@ def get_current_user_optional(
     auth_manager = get_auth_manager()
     token = credentials.credentials
     
+    # 命中缓存时跳过令牌解码和用户查询
+    cached_user = auth_manager.get_cached_user(token)
+    if cached_user:
+        return cached_user
+    
     # 检查是否为API密钥
     if token.startswith("wpic_"):
-        import asyncio
-        return asyncio.run(auth_manager.verify_api_key(token))
-    
-    # 验证JWT令牌
-    payload = auth_manager.verify_token(token)
-    if not payload:
-        return None
+        user = await auth_manager.verify_api_key(token)
+    else:
+        # 验证JWT令牌
+        payload = auth_manager.verify_token(token)
+        if not payload:
+            return None
+        
+        user_id = payload.get("sub")
+        if not user_id:
+            return None
+        
+        try:
+            from app.crud.user import get_user_by_id
+            user = await get_user_by_id(int(user_id))
+        except:
+            return None
     
-    user_id = payload.get("sub")
-    if not user_id:
-        return None
-    
-    try:
-        import asyncio
-        from app.crud.user import get_user_by_id
-        return asyncio.run(get_user_by_id(int(user_id)))
-    except:
-        return None
+    if user:
+        auth_manager.cache_user(token, user)
+    return user
 
 
-def get_current_user_required(
+async def get_current_user_required(
     current_user: Optional[User] = Depends(get_current_user_optional)
 ) -> User:
     """获取当前用户（必需）"""
@@ -66,12 +73,12 @@ def get_current_user_required(
     return current_user
 
 
-def get_admin_user(
+async def get_admin_user(
     current_user: User = Depends(get_current_user_required)
 ) -> User:
     """获取管理员用户"""
     # 简化实现：用户ID为1的为管理员
-    if current_user.id != 1:
+    if current_user.id != ADMIN_USER_ID:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="需要管理员权限"
@@ -86,8 +93,8 @@ async def verify_file_access_dep(
 ) -> FileRecord:
     """验证文件访问权限依赖"""
     try:
-        from app.crud.file import get_file_by_id
-        file_record = await get_file_by_id(file_id)
+        from app.core.loaders import get_file_loader
+        file_record = await get_file_loader().load(file_id)
         if not file_record:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,82 @@
+"""
+批量加载模块
+把同一事件循环轮次内的并发查询合并为一次批量查询
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+from app.core.request_cache import MISSING, get_request_cached, set_request_cached
+from app.crud.file import get_files_by_ids
+from app.models import FileRecord
+
+
+class FileLoader:
+    """文件记录批量加载器
+
+    画廊页面会同时请求多张图片的缩略图，每个请求都要查询一次文件记录。
+    同一轮事件循环中发起的查询在下一轮合并为一次 WHERE id IN (...) 查询，
+    相同文件ID的并发查询共享同一个结果。
+    """
+    
+    def __init__(self):
+        """初始化加载器"""
+        self._pending: Dict[int, List[asyncio.Future]] = {}
+        self._scheduled = False
+    
+    async def load(self, file_id: int) -> Optional[FileRecord]:
+        """加载文件记录
+        
+        Args:
+            file_id: 文件ID
+            
+        Returns:
+            Optional[FileRecord]: 文件记录，不存在时返回None
+        """
+        # 同一请求内重复加载同一文件直接返回已加载的记录，文件变更时请求级缓存会被清空
+        key = ("file", file_id)
+        file_record = get_request_cached(key)
+        if file_record is not MISSING:
+            return file_record
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(file_id, []).append(future)
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._dispatch)
+        file_record = await future
+        set_request_cached(key, file_record)
+        return file_record
+    
+    def _dispatch(self):
+        """取出当前积累的查询并发起批量加载"""
+        pending = self._pending
+        self._pending = {}
+        self._scheduled = False
+        asyncio.ensure_future(self._batch_load(pending))
+    
+    async def _batch_load(self, pending: Dict[int, List[asyncio.Future]]):
+        """执行批量查询并分发结果"""
+        try:
+            file_records = await get_files_by_ids(list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        
+        for file_id, futures in pending.items():
+            file_record = file_records.get(file_id)
+            for future in futures:
+                if not future.done():
+                    future.set_result(file_record)
+
+
+# 全局文件加载器实例
+file_loader = FileLoader()
+
+
+def get_file_loader() -> FileLoader:
+    """获取文件加载器实例"""
+    return file_loader
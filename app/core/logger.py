@@ -6,10 +6,15 @@ import sys
 from pathlib import Path
 from loguru import logger as log
 
+from app.core.config import get_settings
+
 def setup_logger():
     """配置loguru日志"""
     # 移除默认处理器
     log.remove()
+    
+    # 调试模式才展开完整调用栈和变量值，记录异常时遍历局部变量开销很大
+    debug = get_settings().app.debug
 
     # 控制台输出格式
     console_format = (
@@ -26,13 +31,14 @@ def setup_logger():
         "{message}"
     )
     
-    # 添加控制台处理器
+    # 添加控制台处理器，直接同步输出，不经过队列
     log.add(
         sys.stdout,
         format=console_format,
         level="INFO",
         colorize=True,
-        enqueue=True
+        backtrace=debug,
+        diagnose=debug
     )
     
     # 创建日志目录
@@ -48,6 +54,8 @@ def setup_logger():
         retention="30 days",
         compression="zip",
         enqueue=True,
+        backtrace=debug,
+        diagnose=debug,
         encoding="utf-8"
     )
     
@@ -60,6 +68,8 @@ def setup_logger():
         retention="30 days",
         compression="zip",
         enqueue=True,
+        backtrace=debug,
+        diagnose=debug,
         encoding="utf-8"
     )
 
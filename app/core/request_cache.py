@@ -0,0 +1,57 @@
+"""
+请求级缓存模块
+同一个HTTP请求内重复的主键/用户名查询直接返回已加载的对象，请求结束即丢弃，不会跨请求泄漏
+"""
+from contextvars import ContextVar
+from typing import Any, Dict, Hashable, Optional
+
+# 当前请求的缓存字典，请求之外（启动任务、后台任务）为None，不做缓存
+_request_cache: ContextVar[Optional[Dict[Hashable, Any]]] = ContextVar("wpic_request_cache", default=None)
+
+# 缓存未命中标记，区分“未缓存”和“缓存了None”
+MISSING = object()
+
+
+def get_request_cached(key: Hashable) -> Any:
+    """获取当前请求缓存的值，未命中时返回 MISSING"""
+    cache = _request_cache.get()
+    if cache is None:
+        return MISSING
+    return cache.get(key, MISSING)
+
+
+def set_request_cached(key: Hashable, value: Any):
+    """在当前请求缓存中保存值，请求之外调用时忽略"""
+    cache = _request_cache.get()
+    if cache is not None:
+        cache[key] = value
+
+
+def clear_request_cache():
+    """清空当前请求的缓存，数据修改后调用，避免同一请求内读到旧对象"""
+    cache = _request_cache.get()
+    if cache is not None:
+        cache.clear()
+
+
+class RequestCacheMiddleware:
+    """为每个HTTP请求创建独立的请求级缓存
+
+    使用纯ASGI中间件，不包装响应体，流式下载不受影响。
+    """
+
+    def __init__(self, app):
+        """初始化中间件"""
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """处理请求"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_cache.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_cache.reset(token)
@@ -2,15 +2,22 @@
 用户认证和权限控制模块
 支持JWT token认证和文件访问权限控制
 """
+import asyncio
 import hashlib
+import os
 import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
+import bcrypt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import jwt
+from jwt import InvalidTokenError as JWTError
+from jwt.algorithms import get_default_algorithms
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app.core.cache import get_cache_manager
 from app.core.config import get_settings
@@ -19,12 +26,31 @@ from app.models import User, FileRecord
 settings = get_settings()
 cache_manager = get_cache_manager()
 
-# 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码哈希直接使用 bcrypt 扩展（Rust实现），与之前 passlib 生成的 $2b$ 哈希兼容
+BCRYPT_ROUNDS = 12
 
 # JWT Bearer token方案
 security = HTTPBearer(auto_error=False)
 
+# 管理员用户ID，暂时以user_id=1作为管理员
+ADMIN_USER_ID = 1
+
+# 用户访问令牌的 type 声明
+ACCESS_TOKEN_TYPE = "access"
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    """校验bcrypt密码哈希，哈希格式无效时返回False"""
+    try:
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    except ValueError:
+        return False
+
+
+def hash_password(password: str) -> str:
+    """生成bcrypt密码哈希"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
 
 class AuthException(Exception):
     """认证异常"""
@@ -40,9 +66,127 @@ class AuthManager:
         self.algorithm = settings.security.algorithm
         self.access_token_expire_minutes = settings.security.access_token_expire_minutes
         self.enable_auth = settings.security.enable_auth
+        
+        # 签名密钥只在初始化时解析一次：HS算法预先编码密钥，RS/ES算法预先加载PEM密钥
+        self._signing_key = get_default_algorithms()[self.algorithm].prepare_key(self.secret_key)
+        if self.algorithm.startswith("HS"):
+            self._verifying_key = self._signing_key
+        else:
+            self._verifying_key = self._signing_key.public_key()
+        
+        # 令牌到用户的短期缓存，避免并发请求重复解码令牌和查询用户；失效只作用于当前进程，有效期保持很短
+        self.user_cache_ttl = 5
+        self.user_cache_size = 10000
+        self._user_cache: Dict[str, Tuple[float, User]] = {}
+        
+        # 文件访问权限缓存：Redis中多进程共享的一层在文件变更时统一清除，有效期30秒；
+        # 进程内一层的清除只作用于处理变更的进程，有效期限制在2秒，只用于合并同一页面的突发请求
+        self.file_access_cache_ttl = 30
+        self.local_file_access_cache_ttl = 2
+        self.file_access_cache_size = 10000
+        self._file_access_cache: Dict[Tuple[Optional[int], int], Tuple[float, FileRecord]] = {}
+        
+        # 密码验证通过结果的极短期缓存，键为明文密码和哈希的SHA-256摘要，不保存明文，只缓存验证通过的结果
+        self.password_cache_ttl = 5
+        self.password_cache_size = 10000
+        self._password_cache: Dict[bytes, float] = {}
+        
+        # 令牌解码结果的短期缓存，键为令牌的BLAKE2b摘要，过期时间不超过令牌自身的exp
+        self.token_cache_ttl = 5
+        self.token_cache_size = 50000
+        self._token_cache: Dict[bytes, Tuple[float, Dict[str, Any]]] = {}
+        
+        # bcrypt是CPU密集计算，计算时会释放GIL，放到专用线程池执行，避免阻塞事件循环并利用多核
+        self._password_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="bcrypt")
+    
+    def get_cached_user(self, token: str) -> Optional[User]:
+        """获取令牌对应的缓存用户
+        
+        Args:
+            token: 访问令牌或API密钥
+            
+        Returns:
+            Optional[User]: 缓存的用户，不存在或已过期时返回None
+        """
+        cached = self._user_cache.get(token)
+        if cached is None:
+            return None
+        expires_at, user = cached
+        if expires_at < time.monotonic():
+            self._user_cache.pop(token, None)
+            return None
+        return user
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """验证密码
+    def cache_user(self, token: str, user: User):
+        """缓存令牌对应的用户
+        
+        Args:
+            token: 访问令牌或API密钥
+            user: 用户对象
+        """
+        now = time.monotonic()
+        if len(self._user_cache) >= self.user_cache_size:
+            # 先清理过期项，仍然超限时整体清空
+            self._user_cache = {k: v for k, v in self._user_cache.items() if v[0] >= now}
+            if len(self._user_cache) >= self.user_cache_size:
+                self._user_cache.clear()
+        self._user_cache[token] = (now + self.user_cache_ttl, user)
+    
+    def invalidate_user_cache(self, user_id: int):
+        """用户信息变更后清除该用户的缓存
+        
+        Args:
+            user_id: 用户ID
+        """
+        self._user_cache = {k: v for k, v in self._user_cache.items() if v[1].id != user_id}
+    
+    def get_cached_file_access(self, user_id: Optional[int], file_id: int) -> Optional[FileRecord]:
+        """获取已通过权限验证的缓存文件记录
+        
+        Args:
+            user_id: 用户ID，匿名访问时为None
+            file_id: 文件ID
+            
+        Returns:
+            Optional[FileRecord]: 缓存的文件记录，不存在或已过期时返回None
+        """
+        key = (user_id, file_id)
+        cached = self._file_access_cache.get(key)
+        if cached is None:
+            return None
+        expires_at, file_record = cached
+        if expires_at < time.monotonic():
+            self._file_access_cache.pop(key, None)
+            return None
+        return file_record
+    
+    def cache_file_access(self, user_id: Optional[int], file_id: int, file_record: FileRecord):
+        """缓存已通过权限验证的文件记录
+        
+        Args:
+            user_id: 用户ID，匿名访问时为None
+            file_id: 文件ID
+            file_record: 文件记录
+        """
+        now = time.monotonic()
+        if len(self._file_access_cache) >= self.file_access_cache_size:
+            # 先清理过期项，仍然超限时整体清空
+            self._file_access_cache = {k: v for k, v in self._file_access_cache.items() if v[0] >= now}
+            if len(self._file_access_cache) >= self.file_access_cache_size:
+                self._file_access_cache.clear()
+        self._file_access_cache[(user_id, file_id)] = (now + self.local_file_access_cache_ttl, file_record)
+    
+    async def invalidate_file_access_cache(self, file_id: int):
+        """文件变更后清除该文件的权限缓存，包括进程内缓存和Redis缓存
+        
+        Args:
+            file_id: 文件ID
+        """
+        self._file_access_cache = {k: v for k, v in self._file_access_cache.items() if k[1] != file_id}
+        await cache_manager.delete_file_access_cache(file_id)
+    
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """验证密码，bcrypt计算在线程池中执行
         
         Args:
             plain_password: 明文密码
@@ -51,10 +195,30 @@ class AuthManager:
         Returns:
             bool: 密码是否正确
         """
-        return pwd_context.verify(plain_password, hashed_password)
+        key = hashlib.sha256(f"{plain_password}\0{hashed_password}".encode()).digest()
+        now = time.monotonic()
+        expires_at = self._password_cache.get(key)
+        if expires_at is not None:
+            if expires_at >= now:
+                return True
+            self._password_cache.pop(key, None)
+        
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self._password_executor, check_password, plain_password, hashed_password):
+            return False
+        
+        # 等待期间时间已推进，按完成时刻计算过期时间
+        now = time.monotonic()
+        if len(self._password_cache) >= self.password_cache_size:
+            # 先清理过期项，仍然超限时整体清空
+            self._password_cache = {k: v for k, v in self._password_cache.items() if v >= now}
+            if len(self._password_cache) >= self.password_cache_size:
+                self._password_cache.clear()
+        self._password_cache[key] = now + self.password_cache_ttl
+        return True
     
-    def get_password_hash(self, password: str) -> str:
-        """生成密码哈希
+    async def get_password_hash(self, password: str) -> str:
+        """生成密码哈希，bcrypt计算在线程池中执行
         
         Args:
             password: 明文密码
@@ -62,7 +226,8 @@ class AuthManager:
         Returns:
             str: 哈希密码
         """
-        return pwd_context.hash(password)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._password_executor, hash_password, password)
     
     def create_access_token(self, data: Dict[str, Any], 
                           expires_delta: Optional[timedelta] = None) -> str:
@@ -83,9 +248,26 @@ class AuthManager:
             expire = datetime.utcnow() + timedelta(minutes=self.access_token_expire_minutes)
         
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
+        encoded_jwt = jwt.encode(to_encode, self._signing_key, algorithm=self.algorithm)
         return encoded_jwt
     
+    def build_token_data(self, user: User) -> Dict[str, Any]:
+        """构建用户访问令牌数据
+        
+        访问令牌携带 type=access 声明，与文件访问、分享令牌区分；
+        管理员令牌额外携带 adm 声明，管理接口可据此走缓存的用户查询。
+        
+        Args:
+            user: 用户对象
+            
+        Returns:
+            Dict[str, Any]: 令牌数据
+        """
+        data = {"sub": str(user.id), "username": user.username, "type": ACCESS_TOKEN_TYPE}
+        if user.id == ADMIN_USER_ID:
+            data["adm"] = 1
+        return data
+    
     def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
         """验证令牌
         
@@ -95,11 +277,60 @@ class AuthManager:
         Returns:
             Optional[Dict[str, Any]]: 令牌数据，无效时返回None
         """
+        key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        now = time.monotonic()
+        cached = self._token_cache.get(key)
+        if cached is not None:
+            if cached[0] >= now:
+                return cached[1]
+            self._token_cache.pop(key, None)
+        
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
-            return payload
+            payload = jwt.decode(token, self._verifying_key, algorithms=[self.algorithm])
         except JWTError:
             return None
+        
+        expires_at = now + self.token_cache_ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, now + exp - time.time())
+        if len(self._token_cache) >= self.token_cache_size:
+            # 先清理过期项，仍然超限时整体清空
+            self._token_cache = {k: v for k, v in self._token_cache.items() if v[0] >= now}
+            if len(self._token_cache) >= self.token_cache_size:
+                self._token_cache.clear()
+        self._token_cache[key] = (expires_at, payload)
+        return payload
+    
+    async def get_admin_from_token(self, token: str) -> Optional[User]:
+        """从携带管理员声明的访问令牌获取管理员用户
+        
+        只接受 type=access 的访问令牌，并通过带短期缓存的用户查询重新校验
+        用户是否存在、是否启用，停用的管理员无法继续使用已签发的令牌。
+        
+        Args:
+            token: JWT令牌
+            
+        Returns:
+            Optional[User]: 管理员用户，令牌无效、不含管理员声明或用户已停用时返回None
+        """
+        if token.startswith("wpic_"):
+            return None
+        payload = self.verify_token(token)
+        if not payload or payload.get("type") != ACCESS_TOKEN_TYPE or payload.get("adm") != 1:
+            return None
+        try:
+            user_id = int(payload["sub"])
+        except (KeyError, ValueError):
+            return None
+        if user_id != ADMIN_USER_ID:
+            return None
+        
+        from app.crud.user import get_user_by_id
+        user = await get_user_by_id(user_id)
+        if not user or not user.is_active:
+            return None
+        return user
     
     async def authenticate_user(self, username: str, password: str) -> Optional[User]:
         """认证用户
@@ -116,7 +347,7 @@ class AuthManager:
             user = await get_user_by_username(username)
             if not user or not user.is_active:
                 return None
-            if not self.verify_password(password, user.password_hash):
+            if not await self.verify_password(password, user.password_hash):
                 return None
             return user
         except:
@@ -188,7 +419,7 @@ class AuthManager:
         """
         # 使用时间戳和随机数生成唯一文件名
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        random_suffix = secrets.token_hex(8)
+        random_suffix = secrets.token_urlsafe(8)
         
         # 获取文件扩展名
         file_ext = ""
@@ -228,22 +459,24 @@ class AuthManager:
             return False
         
         # 如果是文件所有者，允许访问
-        if user and user.id == file_record.user.id:
+        if user and user.id == file_record.user_id:
             return True
         
-        # 验证文件访问令牌
-        if token:
-            payload = self.verify_file_access_token(token)
-            if payload:
-                token_file_id = payload.get("file_id")
-                if token_file_id == file_record.id:
-                    return True
-        
-        # 验证分享链接令牌
-        if file_record.access_token and token == file_record.access_token:
-            share_payload = self.verify_token(token)
-            if share_payload and share_payload.get("type") == "share_link":
-                return True
+        if not token:
+            return False
+        
+        # 令牌只解码一次，再按类型分别校验
+        payload = self.verify_token(token)
+        if not payload:
+            return False
+        
+        token_type = payload.get("type")
+        # 文件访问令牌需绑定当前文件
+        if token_type == "file_access":
+            return payload.get("file_id") == file_record.id
+        # 分享链接令牌需与文件当前的分享令牌一致
+        if token_type == "share_link":
+            return bool(file_record.access_token) and token == file_record.access_token
         
         return False
     
@@ -259,6 +492,22 @@ class AuthManager:
         """
         return user.storage_used + file_size <= user.storage_quota
     
+    async def reserve_storage(self, user: User, file_size: int) -> bool:
+        """检查配额并预留存储空间
+        
+        Args:
+            user: 用户对象
+            file_size: 文件大小（字节）
+            
+        Returns:
+            bool: 是否有足够的存储空间，成功时已计入使用量
+        """
+        from app.crud.user import reserve_user_storage
+        if not await reserve_user_storage(user.id, file_size):
+            return False
+        user.storage_used += file_size
+        return True
+    
     async def update_storage_usage(self, user: User, size_delta: int):
         """更新存储使用量
         
@@ -266,9 +515,10 @@ class AuthManager:
             user: 用户对象
             size_delta: 大小变化（字节，可为负数）
         """
-        from app.crud.user import update_user
-        new_usage = max(0, user.storage_used + size_delta)
-        await update_user(user.id, storage_used=new_usage)
+        from app.crud.user import increment_user_storage
+        if await increment_user_storage(user.id, size_delta):
+            # 同步内存中（可能来自用户缓存）的用户对象，后续配额检查使用最新值
+            user.storage_used = max(0, user.storage_used + size_delta)
     
     def generate_api_key(self, user_id: int) -> str:
         """生成API密钥
@@ -279,17 +529,8 @@ class AuthManager:
         Returns:
             str: API密钥
         """
-        # 生成32字节的随机密钥
-        random_key = secrets.token_hex(32)
-        
-        # 包含用户ID信息
-        key_data = f"{user_id}:{random_key}:{datetime.utcnow().isoformat()}"
-        
-        # 使用SHA256哈希
-        hash_obj = hashlib.sha256(key_data.encode())
-        api_key = hash_obj.hexdigest()
-        
-        return f"wpic_{api_key}"
+        # 32字节随机数已有足够熵，再做哈希不会增加安全性；用户与密钥的对应关系保存在会话缓存中
+        return f"wpic_{secrets.token_urlsafe(32)}"
     
     async def verify_api_key(self, api_key: str) -> Optional[User]:
         """验证API密钥
@@ -346,10 +587,16 @@ async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] =
     
     token = credentials.credentials
     
+    # 命中缓存时跳过令牌解码和用户查询
+    cached_user = auth_manager.get_cached_user(token)
+    if cached_user:
+        return cached_user
+    
     # 检查是否为API密钥
     if token.startswith("wpic_"):
         user = await auth_manager.verify_api_key(token)
         if user:
+            auth_manager.cache_user(token, user)
             return user
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -378,6 +625,7 @@ async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] =
         from app.crud.user import get_user_by_id
         user = await get_user_by_id(int(user_id))
         if user and user.is_active:
+            auth_manager.cache_user(token, user)
             return user
         else:
             raise HTTPException(
@@ -439,8 +687,8 @@ async def verify_file_access(file_id: int,
         HTTPException: 无权限或文件不存在时抛出
     """
     try:
-        from app.crud.file import get_file_by_id
-        file_record = await get_file_by_id(file_id)
+        from app.core.loaders import get_file_loader
+        file_record = await get_file_loader().load(file_id)
         if not file_record:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -448,10 +696,11 @@ async def verify_file_access(file_id: int,
             )
     except HTTPException:
         raise
-    except:
+    except Exception:
+        # 查询失败不是“文件不存在”，返回503，且不会被当作拒绝访问结果缓存
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="文件不存在"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="文件服务暂时不可用"
         )
     
     has_permission = await auth_manager.check_file_permission(file_record, current_user, token)
@@ -462,3 +711,84 @@ async def verify_file_access(file_id: int,
         )
     
     return file_record
+
+
+# 权限缓存项保存的文件字段：分享令牌不写入共享缓存，所属用户的存储配置（含存储凭据）也不写入，
+# 读取缓存时按 user_id 重新加载所属用户
+FILE_ACCESS_CACHE_FIELDS = frozenset({
+    "id", "user_id", "filename", "original_filename", "file_path", "file_size",
+    "content_type", "file_hash", "width", "height", "format", "status",
+    "download_count", "created_at", "updated_at", "expires_at"
+})
+
+
+def file_access_entry(file_record: FileRecord) -> Dict[str, Any]:
+    """将验证通过的文件记录转换为可存入Redis的权限缓存项，只保留路由需要的非敏感字段"""
+    return {"file": file_record.model_dump(mode="json", include=FILE_ACCESS_CACHE_FIELDS)}
+
+
+async def file_record_from_entry(entry: Dict[str, Any]) -> Optional[FileRecord]:
+    """从权限缓存项还原文件记录，所属用户从用户缓存或数据库加载，数据无效时返回None"""
+    try:
+        from app.crud.user import get_user_by_id
+        file_record = FileRecord.model_validate(entry["file"])
+        owner = await get_user_by_id(file_record.user_id)
+        if owner is None:
+            return None
+        # 不触发反向关系事件，避免在共享的缓存用户对象上累积待加入的文件记录
+        set_committed_value(file_record, "user", owner)
+        return file_record
+    except Exception:
+        return None
+
+
+async def verify_file_access_cached(file_id: int,
+                                    current_user: Optional[User] = Depends(get_current_user),
+                                    token: Optional[str] = None) -> FileRecord:
+    """验证文件访问权限，短期缓存验证结果
+    
+    先查进程内缓存，再查Redis中多个进程共享的缓存；验证通过和拒绝访问的结果都会缓存，
+    避免重复查询同一文件以及反复探测无权限的文件。拒绝访问只缓存文件查询成功后得出的403/404，
+    数据库故障返回的503不缓存。携带访问令牌的请求不使用缓存。
+    
+    Args:
+        file_id: 文件ID
+        current_user: 当前用户
+        token: 访问令牌
+        
+    Returns:
+        FileRecord: 文件记录
+        
+    Raises:
+        HTTPException: 无权限或文件不存在时抛出
+    """
+    if token:
+        return await verify_file_access(file_id, current_user, token)
+    
+    user_id = current_user.id if current_user else None
+    file_record = auth_manager.get_cached_file_access(user_id, file_id)
+    if file_record is not None:
+        return file_record
+    
+    entry = await cache_manager.get_file_access_cache(file_id, user_id)
+    if entry is not None:
+        if "denied" in entry:
+            raise HTTPException(status_code=entry["denied"], detail=entry.get("detail"))
+        file_record = await file_record_from_entry(entry)
+        if file_record is not None and not file_record.is_expired:
+            auth_manager.cache_file_access(user_id, file_id, file_record)
+            return file_record
+    
+    ttl = auth_manager.file_access_cache_ttl
+    try:
+        file_record = await verify_file_access(file_id, current_user)
+    except HTTPException as e:
+        if e.status_code in (status.HTTP_403_FORBIDDEN, status.HTTP_404_NOT_FOUND):
+            await cache_manager.set_file_access_cache(
+                file_id, user_id, {"denied": e.status_code, "detail": e.detail}, ttl
+            )
+        raise
+    
+    auth_manager.cache_file_access(user_id, file_id, file_record)
+    await cache_manager.set_file_access_cache(file_id, user_id, file_access_entry(file_record), ttl)
+    return file_record
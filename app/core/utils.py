@@ -4,10 +4,13 @@
 import hashlib
 import mimetypes
 import os
+import re
 import secrets
+import time
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import BinaryIO, Optional, Tuple, List
 
 
 def get_file_extension(filename: str) -> str:
@@ -19,7 +22,12 @@ def get_file_extension(filename: str) -> str:
     Returns:
         str: 文件扩展名（包含点号）
     """
-    return Path(filename).suffix.lower()
+    # 与 Path(filename).suffix 语义一致，但不构造 Path 对象
+    name = filename.rpartition("/")[2]
+    index = name.rfind(".")
+    if 0 < index < len(name) - 1:
+        return name[index:].lower()
+    return ""
 
 
 def get_content_type(filename: str) -> str:
@@ -31,7 +39,13 @@ def get_content_type(filename: str) -> str:
     Returns:
         str: MIME类型
     """
-    content_type, _ = mimetypes.guess_type(filename)
+    return content_type_for_extension(get_file_extension(filename))
+
+
+@lru_cache(maxsize=256)
+def content_type_for_extension(ext: str) -> str:
+    """根据扩展名获取MIME类型，按扩展名缓存，不同文件名共享同一缓存项"""
+    content_type, _ = mimetypes.guess_type(f"file{ext}")
     return content_type or "application/octet-stream"
 
 
@@ -50,9 +64,33 @@ def generate_random_filename(original_filename: str, length: int = 16) -> str:
     return f"{random_name}{ext}"
 
 
+def create_hasher(algorithm: str = "md5"):
+    """创建增量哈希对象，支持分块 update
+    
+    Args:
+        algorithm: 哈希算法，blake3 需要安装 blake3 包
+        
+    Returns:
+        哈希对象
+    """
+    if algorithm == "blake3":
+        from blake3 import blake3
+        return blake3()
+    elif algorithm in ("md5", "sha1", "sha256"):
+        return hashlib.new(algorithm)
+    else:
+        raise ValueError(f"不支持的哈希算法: {algorithm}")
+
+
+# 超过该大小的数据使用多线程计算BLAKE3
+BLAKE3_MULTITHREAD_MIN_SIZE = 4 * 1024 * 1024
+
+
 def calculate_file_hash(file_data: bytes, algorithm: str = "md5") -> str:
     """计算文件哈希值
     
+    BLAKE3 使用SIMD实现，大文件再开启多线程；SHA-256 由 hashlib 调用 OpenSSL，支持时自动使用SHA指令。
+    
     Args:
         file_data: 文件数据
         algorithm: 哈希算法
@@ -60,14 +98,43 @@ def calculate_file_hash(file_data: bytes, algorithm: str = "md5") -> str:
     Returns:
         str: 哈希值
     """
-    if algorithm == "md5":
-        return hashlib.md5(file_data).hexdigest()
-    elif algorithm == "sha1":
-        return hashlib.sha1(file_data).hexdigest()
-    elif algorithm == "sha256":
-        return hashlib.sha256(file_data).hexdigest()
-    else:
-        raise ValueError(f"不支持的哈希算法: {algorithm}")
+    if algorithm == "blake3" and len(file_data) >= BLAKE3_MULTITHREAD_MIN_SIZE:
+        from blake3 import blake3
+        return blake3(file_data, max_threads=blake3.AUTO).hexdigest()
+    
+    hasher = create_hasher(algorithm)
+    hasher.update(file_data)
+    return hasher.hexdigest()
+
+
+def calculate_file_hash_stream(fileobj: BinaryIO, algorithm: str = "md5", chunk_size: int = 1024 * 1024,
+                               max_size: Optional[int] = None) -> Tuple[str, int]:
+    """从头分块读取文件对象并计算哈希，内存占用只与分块大小有关
+    
+    读取超过 max_size 时立即停止，返回的大小大于 max_size 表示文件超出限制。
+    
+    Args:
+        fileobj: 二进制文件对象
+        algorithm: 哈希算法
+        chunk_size: 分块大小
+        max_size: 最大读取大小，None 表示不限制
+        
+    Returns:
+        Tuple[str, int]: (哈希值, 已读取大小)
+    """
+    hasher = create_hasher(algorithm)
+    file_size = 0
+    fileobj.seek(0)
+    while chunk := fileobj.read(chunk_size):
+        file_size += len(chunk)
+        if max_size is not None and file_size > max_size:
+            break
+        hasher.update(chunk)
+    return hasher.hexdigest(), file_size
+
+
+# 文件大小单位
+SIZE_NAMES = ("B", "KB", "MB", "GB", "TB", "PB")
 
 
 def format_file_size(size_bytes: int) -> str:
@@ -82,12 +149,22 @@ def format_file_size(size_bytes: int) -> str:
     if size_bytes == 0:
         return "0 B"
     
-    size_names = ["B", "KB", "MB", "GB", "TB", "PB"]
-    import math
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(size_bytes / p, 2)
-    return f"{s} {size_names[i]}"
+    # 以1024为底的整数对数即二进制位数除以10
+    i = min((size_bytes.bit_length() - 1) // 10, len(SIZE_NAMES) - 1)
+    s = round(size_bytes / (1 << (10 * i)), 2)
+    return f"{s} {SIZE_NAMES[i]}"
+
+
+# 文件名中的非法字符，以及将其替换为下划线的转换表
+ILLEGAL_FILENAME_CHARS = frozenset('<>:"|?*\\/')
+ILLEGAL_FILENAME_TABLE = str.maketrans({char: "_" for char in ILLEGAL_FILENAME_CHARS})
+
+# Windows保留文件名
+RESERVED_FILENAMES = frozenset({
+    'CON', 'PRN', 'AUX', 'NUL',
+    'COM1', 'COM2', 'COM3', 'COM4', 'COM5', 'COM6', 'COM7', 'COM8', 'COM9',
+    'LPT1', 'LPT2', 'LPT3', 'LPT4', 'LPT5', 'LPT6', 'LPT7', 'LPT8', 'LPT9'
+})
 
 
 def validate_filename(filename: str) -> bool:
@@ -103,23 +180,16 @@ def validate_filename(filename: str) -> bool:
         return False
     
     # 检查非法字符
-    illegal_chars = ['<', '>', ':', '"', '|', '?', '*', '\\', '/']
-    for char in illegal_chars:
-        if char in filename:
-            return False
+    if not ILLEGAL_FILENAME_CHARS.isdisjoint(filename):
+        return False
     
     # 检查文件名长度
     if len(filename) > 255:
         return False
     
     # 检查保留名称（Windows）
-    reserved_names = [
-        'CON', 'PRN', 'AUX', 'NUL',
-        'COM1', 'COM2', 'COM3', 'COM4', 'COM5', 'COM6', 'COM7', 'COM8', 'COM9',
-        'LPT1', 'LPT2', 'LPT3', 'LPT4', 'LPT5', 'LPT6', 'LPT7', 'LPT8', 'LPT9'
-    ]
     name_without_ext = Path(filename).stem.upper()
-    if name_without_ext in reserved_names:
+    if name_without_ext in RESERVED_FILENAMES:
         return False
     
     return True
@@ -135,9 +205,7 @@ def sanitize_filename(filename: str) -> str:
         str: 清理后的文件名
     """
     # 替换非法字符
-    illegal_chars = ['<', '>', ':', '"', '|', '?', '*', '\\', '/']
-    for char in illegal_chars:
-        filename = filename.replace(char, '_')
+    filename = filename.translate(ILLEGAL_FILENAME_TABLE)
     
     # 移除首尾空格和点号
     filename = filename.strip(' .')
@@ -161,11 +229,28 @@ def get_date_path(date: Optional[datetime] = None) -> str:
         str: 日期路径，格式为 YYYY/MM/DD
     """
     if date is None:
-        date = datetime.utcnow()
+        return _get_current_date_path()
     
     return date.strftime("%Y/%m/%d")
 
 
+# 当前UTC日期路径缓存：(自纪元起的天数, 日期路径)
+_current_date_path: Tuple[int, str] = (-1, "")
+
+
+def _get_current_date_path() -> str:
+    """获取当前UTC日期路径，同一天内只格式化一次"""
+    global _current_date_path
+    day = int(time.time() // 86400)
+    if _current_date_path[0] != day:
+        _current_date_path = (day, datetime.utcfromtimestamp(day * 86400).strftime("%Y/%m/%d"))
+    return _current_date_path[1]
+
+
+# 单个字节范围的Range头，多范围请求不匹配，按完整请求处理
+RANGE_HEADER_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
 def parse_range_header(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
     """解析HTTP Range头
     
@@ -176,40 +261,38 @@ def parse_range_header(range_header: str, file_size: int) -> Optional[Tuple[int,
     Returns:
         Optional[Tuple[int, int]]: (start, end) 或 None
     """
-    if not range_header.startswith('bytes='):
+    match = RANGE_HEADER_RE.fullmatch(range_header)
+    if not match:
         return None
     
-    range_spec = range_header[6:]  # 移除 'bytes='
-    
-    if '-' not in range_spec:
+    start_str, end_str = match.groups()
+    if start_str and end_str:
+        # bytes=200-1000
+        start = int(start_str)
+        end = int(end_str)
+    elif start_str:
+        # bytes=200-
+        start = int(start_str)
+        end = file_size - 1
+    elif end_str:
+        # bytes=-500
+        start = file_size - int(end_str)
+        end = file_size - 1
+    else:
         return None
     
-    parts = range_spec.split('-', 1)
-    start_str, end_str = parts
-    
-    try:
-        if start_str and end_str:
-            # bytes=200-1000
-            start = int(start_str)
-            end = int(end_str)
-        elif start_str:
-            # bytes=200-
-            start = int(start_str)
-            end = file_size - 1
-        elif end_str:
-            # bytes=-500
-            start = file_size - int(end_str)
-            end = file_size - 1
-        else:
-            return None
-        
-        # 验证范围
-        if start < 0 or end >= file_size or start > end:
-            return None
-        
-        return start, end
-    except ValueError:
+    # 验证范围
+    if start < 0 or end >= file_size or start > end:
         return None
+    
+    return start, end
+
+
+# 图片文件扩展名
+IMAGE_EXTENSIONS = frozenset({
+    '.jpg', '.jpeg', '.png', '.gif', '.webp',
+    '.bmp', '.tiff', '.tif', '.heic', '.heif'
+})
 
 
 def is_image_file(filename: str) -> bool:
@@ -221,11 +304,7 @@ def is_image_file(filename: str) -> bool:
     Returns:
         bool: 是否为图片
     """
-    image_extensions = {
-        '.jpg', '.jpeg', '.png', '.gif', '.webp', 
-        '.bmp', '.tiff', '.tif', '.heic', '.heif'
-    }
-    return get_file_extension(filename) in image_extensions
+    return get_file_extension(filename) in IMAGE_EXTENSIONS
 
 
 def generate_thumbnail_path(original_path: str, size: Tuple[int, int], format: str = "webp") -> str:
@@ -335,9 +414,9 @@ def clean_expired_files(files: List, current_time: Optional[datetime] = None) ->
     if current_time is None:
         current_time = datetime.utcnow()
     
+    # 每个元素只取一次属性，没有过期时间的文件视为未过期
     return [
-        f for f in files 
-        if not hasattr(f, 'expires_at') or 
-           not f.expires_at or
-           f.expires_at > current_time
+        f for f in files
+        if not (expires_at := getattr(f, 'expires_at', None)) or
+           expires_at > current_time
     ]
@@ -2,25 +2,59 @@
 文件CRUD操作 - SQLModel版本
 """
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 
+from sqlalchemy import update, bindparam, tuple_
 from sqlalchemy.exc import IntegrityError
-from sqlmodel import Session, select, func
+from sqlalchemy.orm import joinedload
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.database import engine
+from app.core.database import get_session_factory
+from app.core.security import get_auth_manager
+from app.core.request_cache import clear_request_cache
+from app.crud.stats import incr_counters, file_counter_deltas, user_file_counter_deltas
 from app.models import FileRecord, FileStatus
 
 
-def get_session():
+def get_session() -> AsyncSession:
     """获取数据库会话"""
-    return Session(engine)
+    return get_session_factory()()
 
 
-async def get_file_by_id(file_id: int) -> Optional[FileRecord]:
-    """根据ID获取文件"""
+async def invalidate_file_access(*file_ids: int):
+    """文件新增、状态或分享令牌变更后清除请求级缓存和文件权限缓存（含拒绝访问的缓存结果）"""
+    clear_request_cache()
+    auth_manager = get_auth_manager()
+    for file_id in file_ids:
+        await auth_manager.invalidate_file_access_cache(file_id)
+
+
+async def get_files_by_ids(file_ids: List[int]) -> Dict[int, FileRecord]:
+    """批量获取文件，所属用户一并联表加载
+
+    查询失败时抛出异常，不返回空结果，避免数据库故障被当作文件不存在。
+
+    Returns:
+        Dict[int, FileRecord]: 文件ID到文件记录的映射，不存在的文件不包含在内
+    """
+    if not file_ids:
+        return {}
+    async with get_session() as session:
+        statement = select(FileRecord).where(FileRecord.id.in_(file_ids)).options(joinedload(FileRecord.user))
+        return {file_record.id: file_record for file_record in (await session.exec(statement)).unique().all()}
+
+
+async def get_user_active_file(file_id: int, user_id: int) -> Optional[FileRecord]:
+    """获取用户自己的有效文件"""
     try:
-        with get_session() as session:
-            return session.get(FileRecord, file_id)
+        async with get_session() as session:
+            statement = select(FileRecord).where(
+                FileRecord.id == file_id,
+                FileRecord.user_id == user_id,
+                FileRecord.status == FileStatus.ACTIVE.value
+            )
+            return (await session.exec(statement)).first()
     except Exception:
         return None
 
@@ -28,29 +62,60 @@ async def get_file_by_id(file_id: int) -> Optional[FileRecord]:
 async def get_file_by_hash(file_hash: str, user_id: int) -> Optional[FileRecord]:
     """根据哈希值获取用户文件"""
     try:
-        with get_session() as session:
+        async with get_session() as session:
             statement = select(FileRecord).where(
                 FileRecord.file_hash == file_hash,
                 FileRecord.user_id == user_id,
                 FileRecord.status == FileStatus.ACTIVE.value
             )
-            return session.exec(statement).first()
+            return (await session.exec(statement)).first()
     except Exception:
         return None
 
 
+async def file_hash_exists(file_hash: str, user_id: int) -> bool:
+    """检查用户是否已有相同哈希的有效文件，只查询主键不加载整行"""
+    try:
+        async with get_session() as session:
+            statement = select(FileRecord.id).where(
+                FileRecord.user_id == user_id,
+                FileRecord.file_hash == file_hash,
+                FileRecord.status == FileStatus.ACTIVE.value
+            ).limit(1)
+            return (await session.exec(statement)).first() is not None
+    except Exception:
+        return False
+
+
+async def get_active_file_hashes() -> List[Tuple[int, str]]:
+    """获取全部有效文件的 (用户ID, 文件哈希)，只查询这两列"""
+    try:
+        async with get_session() as session:
+            statement = select(FileRecord.user_id, FileRecord.file_hash).where(
+                FileRecord.status == FileStatus.ACTIVE.value
+            )
+            return [(user_id, file_hash) for user_id, file_hash in (await session.exec(statement)).all()]
+    except Exception:
+        return []
+
+
 async def create_file_record(user_id: int, **file_data) -> Optional[FileRecord]:
-    """创建文件记录"""
+    """创建文件记录
+
+    主键在 INSERT 时一并取回，其余字段均由Python端生成，提交后无需再 SELECT 刷新。
+    """
     try:
         file_record = FileRecord(
             user_id=user_id,
             **file_data
         )
         
-        with get_session() as session:
+        async with get_session() as session:
             session.add(file_record)
-            session.commit()
-            session.refresh(file_record)
+            if file_record.status == FileStatus.ACTIVE.value:
+                await incr_counters(session, file_counter_deltas(file_record, 1))
+            await session.commit()
+            await invalidate_file_access(file_record.id)
             return file_record
     except IntegrityError:
         return None
@@ -58,102 +123,213 @@ async def create_file_record(user_id: int, **file_data) -> Optional[FileRecord]:
         return None
 
 
+def _user_files_conditions(
+    user_id: int,
+    status: Optional[FileStatus] = None,
+    format_name: Optional[str] = None,
+    cursor: Optional[Tuple[datetime, int]] = None
+) -> list:
+    """用户文件列表查询条件，未指定状态时只查有效文件
+
+    传入 cursor 时只查排在游标文件之后的记录，即 (created_at, id) 小于游标文件的 (created_at, id)。
+    """
+    conditions = [
+        FileRecord.user_id == user_id,
+        FileRecord.status == (status.value if status else FileStatus.ACTIVE.value)
+    ]
+    if format_name:
+        conditions.append(FileRecord.format == format_name)
+    if cursor is not None:
+        conditions.append(tuple_(FileRecord.created_at, FileRecord.id) < tuple_(*cursor))
+    return conditions
+
+
+async def get_user_file_cursor(user_id: int, file_id: int) -> Optional[Tuple[datetime, int]]:
+    """获取用户文件作为分页游标的 (created_at, id)，文件不存在或不属于该用户时返回None"""
+    try:
+        async with get_session() as session:
+            statement = select(FileRecord.created_at).where(
+                FileRecord.id == file_id,
+                FileRecord.user_id == user_id
+            )
+            created_at = (await session.exec(statement)).first()
+    except Exception:
+        return None
+    if created_at is None:
+        return None
+    return created_at, file_id
+
+
+# 文件列表排序，创建时间相同时按ID排序，保证分页稳定
+_USER_FILES_ORDER = (FileRecord.created_at.desc(), FileRecord.id.desc())
+
+
 async def get_user_files(
     user_id: int,
     skip: int = 0,
     limit: int = 20,
-    status: Optional[FileStatus] = None
+    status: Optional[FileStatus] = None,
+    format_name: Optional[str] = None,
+    cursor: Optional[Tuple[datetime, int]] = None
 ) -> List[FileRecord]:
-    """获取用户文件列表"""
+    """获取用户文件列表
+
+    传入 cursor（上一页最后一个文件的 (created_at, id)）时使用游标分页，直接定位并忽略 skip，
+    深分页时不需要扫描并丢弃前面的行。
+    """
     try:
-        with get_session() as session:
-            statement = select(FileRecord).where(FileRecord.user_id == user_id)
-            
-            if status:
-                statement = statement.where(FileRecord.status == status.value)
-            else:
-                statement = statement.where(FileRecord.status == FileStatus.ACTIVE.value)
-            
-            statement = statement.order_by(FileRecord.created_at.desc()).offset(skip).limit(limit)
-            return list(session.exec(statement).all())
+        async with get_session() as session:
+            statement = select(FileRecord).where(
+                *_user_files_conditions(user_id, status, format_name, cursor)
+            ).order_by(*_USER_FILES_ORDER).limit(limit)
+            if cursor is None:
+                statement = statement.offset(skip)
+            return list((await session.exec(statement)).all())
     except Exception:
         return []
 
 
-async def get_user_files_count(user_id: int, status: Optional[FileStatus] = None) -> int:
+async def get_user_files_count(
+    user_id: int,
+    status: Optional[FileStatus] = None,
+    format_name: Optional[str] = None
+) -> int:
     """获取用户文件数量"""
     try:
-        with get_session() as session:
-            statement = select(func.count(FileRecord.id)).where(FileRecord.user_id == user_id)
-            
-            if status:
-                statement = statement.where(FileRecord.status == status.value)
-            else:
-                statement = statement.where(FileRecord.status == FileStatus.ACTIVE.value)
-            
-            return session.exec(statement).one()
+        async with get_session() as session:
+            statement = select(func.count(FileRecord.id)).where(
+                *_user_files_conditions(user_id, status, format_name)
+            )
+            return (await session.exec(statement)).one()
     except Exception:
         return 0
 
 
+async def get_user_files_page(
+    user_id: int,
+    skip: int = 0,
+    limit: int = 20,
+    status: Optional[FileStatus] = None,
+    format_name: Optional[str] = None
+) -> Tuple[List[FileRecord], int]:
+    """分页获取用户文件列表和总数
+
+    总数通过 COUNT(*) OVER() 窗口函数随分页数据一并返回，一次查询完成；
+    页码超出范围没有返回行时，再单独查询总数，首页没有返回行时总数即为0。
+    """
+    try:
+        async with get_session() as session:
+            statement = select(FileRecord, func.count().over().label("total")).where(
+                *_user_files_conditions(user_id, status, format_name)
+            ).order_by(*_USER_FILES_ORDER).offset(skip).limit(limit)
+            rows = (await session.exec(statement)).all()
+        
+        if not rows:
+            return [], await get_user_files_count(user_id, status, format_name) if skip else 0
+        return [file_record for file_record, _ in rows], rows[0].total
+    except Exception:
+        return [], 0
+
+
 async def update_file_record(file_id: int, **kwargs) -> Optional[FileRecord]:
     """更新文件记录"""
     try:
-        with get_session() as session:
-            file_record = session.get(FileRecord, file_id)
+        async with get_session() as session:
+            file_record = await session.get(FileRecord, file_id)
             if not file_record:
                 return None
             
+            was_active = file_record.status == FileStatus.ACTIVE.value
+            
             # 更新字段
             for key, value in kwargs.items():
                 if hasattr(file_record, key):
                     setattr(file_record, key, value)
             
-            # 更新时间
-            file_record.updated_at = datetime.now().replace(microsecond=0)
+            # 文件状态变化时同步计数
+            is_active = file_record.status == FileStatus.ACTIVE.value
+            if was_active != is_active:
+                await incr_counters(session, file_counter_deltas(file_record, 1 if is_active else -1))
             
             session.add(file_record)
-            session.commit()
-            session.refresh(file_record)
+            await session.commit()
+            await invalidate_file_access(file_id)
             return file_record
     except Exception:
         return None
 
 
-async def delete_file_record(file_id: int, user_id: int) -> bool:
-    """删除文件记录（软删除）"""
+async def delete_file_record(file_id: int, user_id: int, created_at: Optional[datetime] = None) -> bool:
+    """删除文件记录（软删除）
+
+    状态检查和修改由一条 UPDATE 完成，不加载整行；
+    调用方已加载文件记录时传入 created_at，可省去查询上传日期（用于调整按天上传计数）。
+    """
     try:
-        with get_session() as session:
-            statement = select(FileRecord).where(
-                FileRecord.id == file_id,
-                FileRecord.user_id == user_id,
-                FileRecord.status == FileStatus.ACTIVE.value
+        async with get_session() as session:
+            if created_at is None:
+                statement = select(FileRecord.created_at).where(FileRecord.id == file_id)
+                created_at = (await session.exec(statement)).first()
+                if created_at is None:
+                    return False
+            
+            result = await session.execute(
+                update(FileRecord)
+                .where(
+                    FileRecord.id == file_id,
+                    FileRecord.user_id == user_id,
+                    FileRecord.status == FileStatus.ACTIVE.value
+                )
+                .values(status=FileStatus.DELETED.value)
             )
-            file_record = session.exec(statement).first()
+            if result.rowcount == 0:
+                return False
             
-            if file_record:
-                file_record.status = FileStatus.DELETED.value
-                file_record.updated_at = datetime.now().replace(microsecond=0)
-                session.add(file_record)
-                session.commit()
-                return True
-            return False
+            await incr_counters(session, user_file_counter_deltas(user_id, created_at, -1))
+            await session.commit()
+            await invalidate_file_access(file_id)
+            return True
     except Exception:
         return False
 
 
-async def increment_download_count(file_id: int) -> bool:
-    """增加下载计数"""
+# Redis不可用时在进程内累积的下载计数，由后台任务与Redis中的计数一并写入数据库
+_queued_download_counts: Dict[int, int] = {}
+
+
+def queue_download_count(file_id: int, amount: int = 1):
+    """在进程内累积下载计数，不访问数据库"""
+    _queued_download_counts[file_id] = _queued_download_counts.get(file_id, 0) + amount
+
+
+def pop_queued_download_counts() -> Dict[int, int]:
+    """取出并清空进程内累积的下载计数"""
+    global _queued_download_counts
+    counts, _queued_download_counts = _queued_download_counts, {}
+    return counts
+
+
+async def flush_download_counts(counts: Dict[int, int]) -> bool:
+    """批量写入累积的下载计数，一个事务内完成
+
+    Args:
+        counts: 文件ID到下载次数增量的映射
+    """
+    if not counts:
+        return True
+    
     try:
-        with get_session() as session:
-            file_record = session.get(FileRecord, file_id)
-            if not file_record:
-                return False
-            
-            file_record.download_count += 1
-            file_record.updated_at = datetime.now().replace(microsecond=0)
-            session.add(file_record)
-            session.commit()
+        table = FileRecord.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("b_file_id"))
+            .values(download_count=table.c.download_count + bindparam("b_amount"), updated_at=table.c.updated_at)
+        )
+        async with get_session() as session:
+            await session.execute(statement, [
+                {"b_file_id": file_id, "b_amount": amount} for file_id, amount in counts.items()
+            ])
+            await session.commit()
             return True
     except Exception:
         return False
@@ -162,12 +338,12 @@ async def increment_download_count(file_id: int) -> bool:
 async def get_files_by_format(format_name: str, limit: int = 100) -> List[FileRecord]:
     """根据格式获取文件"""
     try:
-        with get_session() as session:
+        async with get_session() as session:
             statement = select(FileRecord).where(
                 FileRecord.format == format_name,
                 FileRecord.status == FileStatus.ACTIVE.value
             ).limit(limit)
-            return list(session.exec(statement).all())
+            return list((await session.exec(statement)).all())
     except Exception:
         return []
 
@@ -176,12 +352,12 @@ async def get_expired_files() -> List[FileRecord]:
     """获取过期文件"""
     try:
         current_time = datetime.now()
-        with get_session() as session:
+        async with get_session() as session:
             statement = select(FileRecord).where(
                 FileRecord.expires_at < current_time,
                 FileRecord.status == FileStatus.ACTIVE.value
             )
-            return list(session.exec(statement).all())
+            return list((await session.exec(statement)).all())
     except Exception:
         return []
 
@@ -189,12 +365,12 @@ async def get_expired_files() -> List[FileRecord]:
 async def get_file_by_access_token(access_token: str) -> Optional[FileRecord]:
     """根据访问令牌获取文件"""
     try:
-        with get_session() as session:
+        async with get_session() as session:
             statement = select(FileRecord).where(
                 FileRecord.access_token == access_token,
                 FileRecord.status == FileStatus.ACTIVE.value
             )
-            return session.exec(statement).first()
+            return (await session.exec(statement)).first()
     except Exception:
         return None
 
@@ -203,40 +379,24 @@ async def get_files_by_user_with_pagination(
     user_id: int,
     page: int = 1,
     page_size: int = 20
-) -> tuple[List[FileRecord], int]:
-    """分页获取用户文件和总数"""
-    try:
-        with get_session() as session:
-            # 获取总数
-            count_statement = select(func.count(FileRecord.id)).where(
-                FileRecord.user_id == user_id,
-                FileRecord.status == FileStatus.ACTIVE.value
-            )
-            total = session.exec(count_statement).one()
-            
-            # 获取分页数据
-            skip = (page - 1) * page_size
-            statement = select(FileRecord).where(
-                FileRecord.user_id == user_id,
-                FileRecord.status == FileStatus.ACTIVE.value
-            ).order_by(FileRecord.created_at.desc()).offset(skip).limit(page_size)
-            
-            files = list(session.exec(statement).all())
-            return files, total
-    except Exception:
-        return [], 0
+) -> Tuple[List[FileRecord], int]:
+    """分页获取用户文件和总数，总数与分页数据在同一次查询中返回"""
+    return await get_user_files_page(user_id, skip=(page - 1) * page_size, limit=page_size)
 
 
 async def hard_delete_file_record(file_id: int) -> bool:
     """物理删除文件记录"""
     try:
-        with get_session() as session:
-            file_record = session.get(FileRecord, file_id)
+        async with get_session() as session:
+            file_record = await session.get(FileRecord, file_id)
             if not file_record:
                 return False
             
-            session.delete(file_record)
-            session.commit()
+            if file_record.status == FileStatus.ACTIVE.value:
+                await incr_counters(session, file_counter_deltas(file_record, -1))
+            await session.delete(file_record)
+            await session.commit()
+            await invalidate_file_access(file_id)
             return True
     except Exception:
         return False
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""
+统计CRUD操作
+计数类统计由 wpic_stats_counters 表增量维护，查询时只做主键点查
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import update, delete, bindparam
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.database import get_engine, get_session_factory
+from app.core.logger import logger
+from app.models import User, FileRecord, FileStatus, StatsCounter, StorageType
+
+# 计数键
+USERS_TOTAL_KEY = "users_total"
+FILES_ACTIVE_KEY = "files_active"
+
+# 最近上传统计窗口（天）
+RECENT_UPLOAD_DAYS = 7
+
+
+def get_session() -> AsyncSession:
+    """获取数据库会话"""
+    return get_session_factory()()
+
+
+async def fetch_one(statement, params: Optional[Dict[str, Any]] = None):
+    """直接在Core连接上执行只读统计查询并返回单行结果
+
+    统计查询只返回标量，不需要ORM会话的身份映射和结果封装。
+    """
+    async with get_engine().connect() as connection:
+        return (await connection.execute(statement, params or {})).one()
+
+
+async def fetch_all(statement, params: Optional[Dict[str, Any]] = None):
+    """直接在Core连接上执行只读统计查询并返回全部结果"""
+    async with get_engine().connect() as connection:
+        return (await connection.execute(statement, params or {})).all()
+
+
+def user_files_key(user_id: int) -> str:
+    """用户有效文件数计数键"""
+    return f"user:{user_id}:files"
+
+
+def user_uploads_key(user_id: int, day: datetime) -> str:
+    """用户按天上传数计数键"""
+    return f"user:{user_id}:uploads:{day.strftime('%Y%m%d')}"
+
+
+def recent_upload_keys(user_id: int, now: datetime = None) -> List[str]:
+    """最近上传统计窗口内的按天计数键"""
+    now = now or datetime.now()
+    return [user_uploads_key(user_id, now - timedelta(days=i)) for i in range(RECENT_UPLOAD_DAYS)]
+
+
+def file_counter_deltas(file_record: FileRecord, sign: int) -> Dict[str, int]:
+    """有效文件新增（sign=1）或移除（sign=-1）时需要调整的计数"""
+    return user_file_counter_deltas(file_record.user_id, file_record.created_at, sign)
+
+
+def user_file_counter_deltas(user_id: int, created_at: datetime, sign: int) -> Dict[str, int]:
+    """按用户ID和上传时间计算有效文件计数的调整量，无需加载完整文件记录"""
+    return {
+        FILES_ACTIVE_KEY: sign,
+        user_files_key(user_id): sign,
+        user_uploads_key(user_id, created_at): sign
+    }
+
+
+def _counter_upsert(dialect_name: str, key: str, delta: int):
+    """构建计数器的原子 upsert 语句，不支持的数据库返回None
+
+    计数不存在时插入 delta，已存在时在原值上累加，
+    并发创建同一个新计数键时不会因主键冲突失败。只用于正增量。
+    """
+    if dialect_name in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+        return insert(StatsCounter).values(key=key, value=delta).on_conflict_do_update(
+            index_elements=[StatsCounter.key],
+            set_={"value": StatsCounter.value + delta}
+        )
+    if dialect_name in ("mysql", "mariadb"):
+        return mysql.insert(StatsCounter).values(key=key, value=delta).on_duplicate_key_update(
+            value=StatsCounter.value + delta
+        )
+    return None
+
+
+async def incr_counters(session: AsyncSession, deltas: Dict[str, int]):
+    """在当前事务中增量更新计数器
+
+    正增量在计数不存在时创建；负增量不创建计数，减到0的计数直接删除（读取时缺失按0处理），
+    避免删除旧文件时为早已不在统计窗口内的按天计数键留下值为0的行。
+
+    Args:
+        session: 数据库会话，由调用方负责提交
+        deltas: 计数键到增量的映射
+    """
+    dialect_name = session.bind.dialect.name
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        if delta < 0:
+            await session.execute(
+                delete(StatsCounter).where(StatsCounter.key == key, StatsCounter.value + delta <= 0)
+            )
+            await session.execute(
+                update(StatsCounter)
+                .where(StatsCounter.key == key)
+                .values(value=StatsCounter.value + delta)
+            )
+            continue
+        statement = _counter_upsert(dialect_name, key, delta)
+        if statement is not None:
+            await session.execute(statement)
+            continue
+        result = await session.execute(
+            update(StatsCounter)
+            .where(StatsCounter.key == key)
+            .values(value=StatsCounter.value + delta)
+        )
+        if result.rowcount == 0:
+            session.add(StatsCounter(key=key, value=delta))
+
+
+async def remove_user_counters(session: AsyncSession, user_id: int):
+    """在当前事务中移除用户的计数：用户总数减一，有效文件总数减去该用户的有效文件数，删除该用户的全部计数键
+
+    Args:
+        session: 数据库会话，由调用方负责提交
+        user_id: 被删除的用户ID
+    """
+    statement = select(func.count(FileRecord.id)).where(
+        FileRecord.user_id == user_id,
+        FileRecord.status == FileStatus.ACTIVE.value
+    )
+    active_files = (await session.exec(statement)).one()
+    await incr_counters(session, {USERS_TOTAL_KEY: -1, FILES_ACTIVE_KEY: -active_files})
+    await session.execute(
+        delete(StatsCounter).where(StatsCounter.key.startswith(f"user:{user_id}:", autoescape=True))
+    )
+
+
+async def rebuild_stats_counters() -> bool:
+    """根据现有数据重建全部计数器
+
+    用于初始化计数表并修正可能的计数漂移，同时清理过期的按天计数。
+    不清空整张表，只写入与实际数据不一致的计数、插入缺失的计数并删除多余的计数，
+    减少覆盖其他进程并发增量的范围；多进程部署时由调用方保证同一时间只有一个进程执行。
+    """
+    active = FileRecord.status == FileStatus.ACTIVE.value
+    since = (datetime.now() - timedelta(days=RECENT_UPLOAD_DAYS - 1)).replace(hour=0, minute=0, second=0)
+
+    try:
+        async with get_session() as session:
+            counters: Dict[str, int] = {
+                USERS_TOTAL_KEY: (await session.exec(select(func.count(User.id)))).one(),
+                FILES_ACTIVE_KEY: (await session.exec(select(func.count(FileRecord.id)).where(active))).one()
+            }
+
+            statement = select(FileRecord.user_id, func.count(FileRecord.id)).where(active).group_by(FileRecord.user_id)
+            for user_id, count in (await session.exec(statement)).all():
+                counters[user_files_key(user_id)] = count
+
+            statement = select(FileRecord.user_id, FileRecord.created_at).where(active, FileRecord.created_at >= since)
+            for user_id, created_at in (await session.exec(statement)).all():
+                key = user_uploads_key(user_id, created_at)
+                counters[key] = counters.get(key, 0) + 1
+
+            existing = dict((await session.exec(select(StatsCounter.key, StatsCounter.value))).all())
+
+            stale = [key for key in existing if key not in counters]
+            for i in range(0, len(stale), 500):
+                await session.execute(delete(StatsCounter).where(StatsCounter.key.in_(stale[i:i + 500])))
+
+            table = StatsCounter.__table__
+            changed = [
+                {"b_key": key, "b_value": value}
+                for key, value in counters.items() if key in existing and existing[key] != value
+            ]
+            if changed:
+                await session.execute(
+                    update(table).where(table.c.key == bindparam("b_key")).values(value=bindparam("b_value")),
+                    changed
+                )
+
+            session.add_all([
+                StatsCounter(key=key, value=value) for key, value in counters.items() if key not in existing
+            ])
+            await session.commit()
+            return True
+    except Exception as e:
+        logger.error(f"重建统计计数器失败: {e}")
+        return False
+
+
+# 统计查询语句在模块加载时构建一次，请求时只绑定参数
+_ACTIVE_FILE = FileRecord.status == FileStatus.ACTIVE.value
+
+_SYSTEM_TOTALS_STMT = select(
+    select(func.coalesce(func.max(StatsCounter.value), 0))
+    .where(StatsCounter.key == USERS_TOTAL_KEY)
+    .scalar_subquery().label("total_users"),
+    select(func.coalesce(func.max(StatsCounter.value), 0))
+    .where(StatsCounter.key == FILES_ACTIVE_KEY)
+    .scalar_subquery().label("total_files"),
+    select(func.coalesce(func.sum(User.storage_used), 0))
+    .scalar_subquery().label("total_storage_used"),
+    select(func.coalesce(func.sum(FileRecord.download_count), 0))
+    .where(_ACTIVE_FILE)
+    .scalar_subquery().label("total_downloads")
+)
+
+_FILES_BY_FORMAT_STMT = select(FileRecord.format, func.count(FileRecord.id)).where(
+    _ACTIVE_FILE
+).group_by(FileRecord.format)
+
+_STORAGE_BY_TYPE_STMT = select(
+    User.storage_type, func.coalesce(func.sum(User.storage_used), 0)
+).group_by(User.storage_type)
+
+_USER_FILE_STATS_STMT = select(
+    select(func.coalesce(func.max(StatsCounter.value), 0))
+    .where(StatsCounter.key == bindparam("file_key"))
+    .scalar_subquery().label("file_count"),
+    select(func.coalesce(func.sum(StatsCounter.value), 0))
+    .where(StatsCounter.key.in_(bindparam("upload_keys", expanding=True)))
+    .scalar_subquery().label("recent_uploads"),
+    select(func.coalesce(func.sum(FileRecord.download_count), 0))
+    .where(FileRecord.user_id == bindparam("user_id"), _ACTIVE_FILE)
+    .scalar_subquery().label("total_downloads")
+)
+
+
+async def get_system_totals() -> Dict[str, int]:
+    """获取系统汇总统计
+
+    使用标量子查询在一次数据库往返中取回用户数、文件数、存储用量和下载次数。
+    """
+    row = await fetch_one(_SYSTEM_TOTALS_STMT)
+
+    return {
+        "total_users": int(row.total_users or 0),
+        "total_files": int(row.total_files or 0),
+        "total_storage_used": int(row.total_storage_used or 0),
+        "total_downloads": int(row.total_downloads or 0)
+    }
+
+
+async def get_files_by_format() -> Dict[str, int]:
+    """按图片格式统计有效文件数，分组在数据库中完成"""
+    files_by_format: Dict[str, int] = {}
+    for format_name, count in await fetch_all(_FILES_BY_FORMAT_STMT):
+        key = (format_name or "other").lower()
+        files_by_format[key] = files_by_format.get(key, 0) + count
+    return files_by_format
+
+
+async def get_storage_by_type() -> Dict[str, int]:
+    """按存储类型统计已用存储空间，分组在数据库中完成"""
+    storage_by_type: Dict[str, int] = {storage_type.value: 0 for storage_type in StorageType}
+    for storage_type, storage_used in await fetch_all(_STORAGE_BY_TYPE_STMT):
+        storage_by_type[storage_type] = storage_by_type.get(storage_type, 0) + int(storage_used or 0)
+    return storage_by_type
+
+
+async def get_user_file_stats(user_id: int) -> Dict[str, int]:
+    """获取用户文件统计
+
+    文件数和最近上传数读取计数器，下载总数对用户文件求和，一次数据库往返完成。
+    """
+    row = await fetch_one(_USER_FILE_STATS_STMT, {
+        "file_key": user_files_key(user_id),
+        "upload_keys": recent_upload_keys(user_id),
+        "user_id": user_id
+    })
+
+    return {
+        "file_count": int(row.file_count or 0),
+        "recent_uploads": int(row.recent_uploads or 0),
+        "total_downloads": int(row.total_downloads or 0)
+    }
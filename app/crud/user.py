@@ -1,47 +1,153 @@
 """
 用户CRUD操作
 """
-from typing import Optional, List
-from datetime import datetime
+import asyncio
+import time
+from typing import Any, Dict, Optional, List, Set, Tuple
 
-from sqlmodel import Session, select, func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Float, case, cast, update
+from sqlalchemy.engine import Row
 from sqlalchemy.exc import IntegrityError
 
 from app.core.security import get_auth_manager
-from app.core.database import engine
+from app.core.database import get_session_factory
+from app.core.request_cache import MISSING, get_request_cached, set_request_cached, clear_request_cache
+from app.crud.stats import incr_counters, remove_user_counters, USERS_TOTAL_KEY
 from app.models import User
 
 
-def get_session():
+def get_session() -> AsyncSession:
     """获取数据库会话"""
-    return Session(engine)
+    return get_session_factory()()
+
+
+# 用户查询的跨请求短期缓存：(查询字段, 值) -> (过期时间, 用户)
+# 只缓存存在的用户，且有效期很短：失效只作用于当前进程，其他进程最多在有效期内读到旧数据
+USER_LOOKUP_CACHE_TTL = 5
+USER_LOOKUP_CACHE_SIZE = 10000
+_user_lookup_cache: Dict[Tuple[str, Any], Tuple[float, User]] = {}
+# 用户ID -> 该用户的全部查询键，失效时无需遍历整个缓存
+_user_lookup_keys: Dict[int, Set[Tuple[str, Any]]] = {}
+# 每个查询键一把锁及其引用数，缓存过期时并发请求只由一个请求查询数据库
+_user_lookup_locks: Dict[Tuple[str, Any], asyncio.Lock] = {}
+_user_lookup_lock_refs: Dict[Tuple[str, Any], int] = {}
+
+
+async def _query_user(key: Tuple[str, Any]) -> Optional[User]:
+    """按查询键从数据库加载用户，查询失败时抛出异常"""
+    field, value = key
+    async with get_session() as session:
+        if field == "id":
+            return await session.get(User, value)
+        column = User.username if field == "username" else User.email
+        return (await session.exec(select(User).where(column == value))).first()
+
+
+def _cache_user_lookup(key: Tuple[str, Any], user: User):
+    """保存用户查询结果"""
+    global _user_lookup_cache, _user_lookup_keys
+    now = time.monotonic()
+    if len(_user_lookup_cache) >= USER_LOOKUP_CACHE_SIZE:
+        # 先清理过期项，仍然超限时整体清空
+        _user_lookup_cache = {k: v for k, v in _user_lookup_cache.items() if v[0] >= now}
+        if len(_user_lookup_cache) >= USER_LOOKUP_CACHE_SIZE:
+            _user_lookup_cache.clear()
+        _user_lookup_keys = {}
+        for cached_key, (_, cached_user) in _user_lookup_cache.items():
+            _user_lookup_keys.setdefault(cached_user.id, set()).add(cached_key)
+    _user_lookup_cache[key] = (now + USER_LOOKUP_CACHE_TTL, user)
+    _user_lookup_keys.setdefault(user.id, set()).add(key)
+
+
+def _get_fresh_user_lookup(key: Tuple[str, Any]) -> Any:
+    """获取未过期的缓存用户，未命中时返回 MISSING"""
+    cached = _user_lookup_cache.get(key)
+    if cached is None or cached[0] < time.monotonic():
+        return MISSING
+    return cached[1]
+
+
+async def _get_user_cached(key: Tuple[str, Any]) -> Optional[User]:
+    """依次查询请求级缓存、跨请求短期缓存和数据库"""
+    user = get_request_cached(key)
+    if user is not MISSING:
+        return user
+    
+    user = _get_fresh_user_lookup(key)
+    if user is MISSING:
+        lock = _user_lookup_locks.get(key)
+        if lock is None:
+            lock = _user_lookup_locks[key] = asyncio.Lock()
+        _user_lookup_lock_refs[key] = _user_lookup_lock_refs.get(key, 0) + 1
+        try:
+            async with lock:
+                # 等待锁期间其他请求可能已经完成查询
+                user = _get_fresh_user_lookup(key)
+                if user is MISSING:
+                    try:
+                        user = await _query_user(key)
+                    except Exception:
+                        return None
+                    if user is not None:
+                        _cache_user_lookup(key, user)
+        finally:
+            # 最后一个使用者退出后才移除锁，避免排队中的请求与新请求各自持有不同的锁
+            refs = _user_lookup_lock_refs[key] - 1
+            if refs:
+                _user_lookup_lock_refs[key] = refs
+            else:
+                _user_lookup_lock_refs.pop(key, None)
+                _user_lookup_locks.pop(key, None)
+    
+    set_request_cached(key, user)
+    return user
+
+
+def invalidate_user_lookups(user_id: Optional[int] = None):
+    """用户数据变更后清除相关的查询缓存
+    
+    Args:
+        user_id: 变更的用户ID，清除该用户的全部缓存项；为None时只清除请求级缓存
+    """
+    clear_request_cache()
+    if user_id is None:
+        return
+    for key in _user_lookup_keys.pop(user_id, ()):
+        _user_lookup_cache.pop(key, None)
 
 
 async def get_user_by_id(user_id: int) -> Optional[User]:
-    """根据ID获取用户"""
-    try:
-        with get_session() as session:
-            return session.get(User, user_id)
-    except Exception:
-        return None
+    """根据ID获取用户，结果短期缓存"""
+    return await _get_user_cached(("id", user_id))
 
 
 async def get_user_by_username(username: str) -> Optional[User]:
-    """根据用户名获取用户"""
-    try:
-        with get_session() as session:
-            statement = select(User).where(User.username == username)
-            return session.exec(statement).first()
-    except Exception:
-        return None
+    """根据用户名获取用户，结果短期缓存"""
+    return await _get_user_cached(("username", username))
 
 
 async def get_user_by_email(email: str) -> Optional[User]:
-    """根据邮箱获取用户"""
+    """根据邮箱获取用户，结果短期缓存"""
+    return await _get_user_cached(("email", email))
+
+
+async def get_username_email_conflict(username: str, email: str) -> Optional[Tuple[str, str]]:
+    """一次查询检查用户名或邮箱是否已被占用
+
+    Returns:
+        Optional[Tuple[str, str]]: 冲突用户的(用户名, 邮箱)，用户名冲突优先返回；无冲突时返回None
+    """
     try:
-        with get_session() as session:
-            statement = select(User).where(User.email == email)
-            return session.exec(statement).first()
+        async with get_session() as session:
+            statement = (
+                select(User.username, User.email)
+                .where((User.username == username) | (User.email == email))
+                .order_by((User.username == username).desc())
+                .limit(1)
+            )
+            return (await session.exec(statement)).first()
     except Exception:
         return None
 
@@ -50,7 +156,7 @@ async def create_user(username: str, email: str, password: str, **kwargs) -> Opt
     """创建用户"""
     try:
         auth_manager = get_auth_manager()
-        password_hash = auth_manager.get_password_hash(password)
+        password_hash = await auth_manager.get_password_hash(password)
         
         user = User(
             username=username,
@@ -59,10 +165,11 @@ async def create_user(username: str, email: str, password: str, **kwargs) -> Opt
             **kwargs
         )
         
-        with get_session() as session:
+        async with get_session() as session:
             session.add(user)
-            session.commit()
-            session.refresh(user)
+            await incr_counters(session, {USERS_TOTAL_KEY: 1})
+            await session.commit()
+            invalidate_user_lookups()
             return user
     except IntegrityError:
         # 用户名或邮箱已存在
@@ -77,7 +184,7 @@ async def authenticate_user(username: str, password: str) -> Optional[User]:
     user = await get_user_by_username(username)
     if not user:
         return None
-    if not auth_manager.verify_password(password, user.password_hash):
+    if not await auth_manager.verify_password(password, user.password_hash):
         return None
     return user
 
@@ -85,8 +192,8 @@ async def authenticate_user(username: str, password: str) -> Optional[User]:
 async def update_user(user_id: int, **kwargs) -> Optional[User]:
     """更新用户信息"""
     try:
-        with get_session() as session:
-            user = session.get(User, user_id)
+        async with get_session() as session:
+            user = await session.get(User, user_id)
             if not user:
                 return None
             
@@ -95,53 +202,56 @@ async def update_user(user_id: int, **kwargs) -> Optional[User]:
                 if hasattr(user, key):
                     setattr(user, key, value)
             
-            # 更新时间
-            user.updated_at = datetime.now().replace(microsecond=0)
-            
             session.add(user)
-            session.commit()
-            session.refresh(user)
+            await session.commit()
+            invalidate_user_lookups(user_id)
+            get_auth_manager().invalidate_user_cache(user_id)
             return user
     except Exception:
         return None
 
 
-async def get_users(skip: int = 0, limit: int = 100) -> List[User]:
-    """获取用户列表"""
-    try:
-        with get_session() as session:
-            statement = select(User).offset(skip).limit(limit)
-            return list(session.exec(statement).all())
-    except Exception:
-        return []
-
-
-async def get_users_count() -> int:
-    """获取用户总数"""
-    try:
-        with get_session() as session:
-            statement = select(func.count(User.id))
-            return session.exec(statement).one()
-    except Exception:
-        return 0
-
+# 用户列表只查询响应需要的列，剩余空间和使用百分比直接在SQL中计算
+_USER_LIST_COLUMNS = (
+    User.id,
+    User.username,
+    User.email,
+    User.storage_type,
+    User.storage_quota,
+    User.storage_used,
+    case(
+        (User.storage_quota > User.storage_used, User.storage_quota - User.storage_used),
+        else_=0
+    ).label("remaining_storage"),
+    cast(case(
+        (User.storage_quota == 0, 0.0),
+        else_=User.storage_used * 100.0 / User.storage_quota
+    ), Float).label("storage_usage_percent"),
+    User.is_active,
+    User.created_at,
+    User.updated_at
+)
 
-async def get_all_users() -> List[User]:
-    """获取所有用户"""
-    try:
-        with get_session() as session:
-            statement = select(User).order_by(User.created_at.desc())
-            return list(session.exec(statement).all())
-    except Exception:
-        return []
 
+async def get_users_paginated(
+    skip: int = 0,
+    limit: int = 20,
+    cursor_id: Optional[int] = None
+) -> List[Row]:
+    """分页获取用户列表
 
-async def get_users_paginated(skip: int = 0, limit: int = 20) -> List[User]:
-    """分页获取用户列表"""
+    两种模式均按id倒序（即创建先后），保证偏移分页返回的最后一个id可直接作为游标；
+    传入 cursor_id 时使用游标分页（id < cursor_id），避免深分页时 OFFSET 扫描并丢弃大量行。
+    返回包含 remaining_storage 和 storage_usage_percent 列的结果行。
+    """
     try:
-        with get_session() as session:
-            statement = select(User).offset(skip).limit(limit).order_by(User.created_at.desc())
-            return list(session.exec(statement).all())
+        async with get_session() as session:
+            statement = select(*_USER_LIST_COLUMNS)
+            if cursor_id is not None:
+                statement = statement.where(User.id < cursor_id).order_by(User.id.desc()).limit(limit)
+            else:
+                statement = statement.order_by(User.id.desc()).offset(skip).limit(limit)
+            return list((await session.exec(statement)).all())
     except Exception:
         return []
 
@@ -149,28 +259,57 @@ async def get_users_paginated(skip: int = 0, limit: int = 20) -> List[User]:
 async def delete_user(user_id: int) -> bool:
     """删除用户"""
     try:
-        with get_session() as session:
-            user = session.get(User, user_id)
+        async with get_session() as session:
+            user = await session.get(User, user_id)
             if not user:
                 return False
             
-            session.delete(user)
-            session.commit()
+            # 计数与删除在同一事务中调整
+            await remove_user_counters(session, user_id)
+            await session.delete(user)
+            await session.commit()
+            invalidate_user_lookups(user_id)
+            get_auth_manager().invalidate_user_cache(user_id)
             return True
     except Exception:
         return False
 
 
-async def update_user_storage(user_id: int, storage_used: int) -> Optional[User]:
-    """更新用户存储使用量"""
-    return await update_user(user_id, storage_used=storage_used)
+async def increment_user_storage(user_id: int, size_delta: int) -> bool:
+    """在数据库中原子调整用户存储使用量，结果不小于0"""
+    try:
+        async with get_session() as session:
+            new_usage = User.storage_used + size_delta
+            result = await session.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(storage_used=case((new_usage < 0, 0), else_=new_usage))
+            )
+            await session.commit()
+            invalidate_user_lookups(user_id)
+            return result.rowcount > 0
+    except Exception:
+        return False
+
+
+async def reserve_user_storage(user_id: int, size: int) -> bool:
+    """在配额范围内原子增加用户存储使用量
 
+    配额检查与更新在同一条 UPDATE 中完成，并发上传不会超出配额。
 
-async def get_active_users() -> List[User]:
-    """获取活跃用户"""
+    Returns:
+        bool: 是否预留成功，配额不足或用户不存在时返回False
+    """
     try:
-        with get_session() as session:
-            statement = select(User).where(User.is_active == True)
-            return list(session.exec(statement).all())
+        async with get_session() as session:
+            new_usage = User.storage_used + size
+            result = await session.execute(
+                update(User)
+                .where(User.id == user_id, new_usage <= User.storage_quota)
+                .values(storage_used=new_usage)
+            )
+            await session.commit()
+            invalidate_user_lookups(user_id)
+            return result.rowcount > 0
     except Exception:
-        return []
\ No newline at end of file
+        return False
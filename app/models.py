@@ -4,8 +4,10 @@
 """
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Dict, Optional
 
+from sqlalchemy import JSON, Column, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -33,18 +35,30 @@ class FileStatus(str, Enum):
 class User(SQLModel, table=True):
     """用户模型"""
     __tablename__ = "wpic_users"
+    __table_args__ = (
+        # PostgreSQL 下存储配置为 JSONB，GIN 索引支持按配置子键过滤；其他数据库不创建
+        Index("ix_wpic_users_storage_config_gin", "storage_config", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True, description="用户ID，主键")
     username: str = Field(max_length=50, unique=True, index=True, description="用户名，唯一索引")
     email: str = Field(max_length=100, unique=True, index=True, description="邮箱地址，唯一索引")
     password_hash: str = Field(max_length=255, description="密码哈希值")
     storage_type: str = Field(default=StorageType.LOCAL.value, max_length=20, description="存储类型：local/webdav/s3")
-    storage_config: str = Field(default="{}", description="存储配置信息JSON")
+    storage_config: Dict[str, Any] = Field(
+        default_factory=dict,
+        sa_column=Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False, default=dict),
+        description="存储配置信息，PostgreSQL 下为 JSONB，其他数据库为 JSON"
+    )
     storage_quota: int = Field(default=1024*1024*100, description="存储配额，单位字节，默认100MB")
     storage_used: int = Field(default=0, description="已使用存储空间，单位字节")
     is_active: bool = Field(default=True, description="用户是否激活")
     created_at: datetime = Field(default_factory=get_current_timestamp, description="创建时间")
-    updated_at: datetime = Field(default_factory=get_current_timestamp, description="更新时间")
+    updated_at: datetime = Field(
+        default_factory=get_current_timestamp,
+        sa_column_kwargs={"onupdate": get_current_timestamp},
+        description="更新时间，行更新时由SQLAlchemy自动设置"
+    )
 
     # 关系
     file_records: list["FileRecord"] = Relationship(back_populates="user")
@@ -67,6 +81,14 @@ class User(SQLModel, table=True):
 class FileRecord(SQLModel, table=True):
     """文件记录模型"""
     __tablename__ = "wpic_file_records"
+    __table_args__ = (
+        # 上传去重按 用户+哈希+状态 查询，复合索引可直接覆盖
+        Index("ix_wpic_file_records_user_hash_status", "user_id", "file_hash", "status"),
+        # 文件列表按 用户+状态 过滤并按 创建时间+ID 倒序分页，索引有序，反向扫描即可避免排序，游标分页可直接定位
+        Index("ix_wpic_file_records_user_status_created_id", "user_id", "status", "created_at", "id"),
+        # 过期清理按 状态+过期时间 范围查询
+        Index("ix_wpic_file_records_status_expires", "status", "expires_at"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True, description="文件记录ID，主键")
     user_id: int = Field(foreign_key="wpic_users.id", description="所属用户ID，外键关联wpic_users.id")
@@ -83,7 +105,11 @@ class FileRecord(SQLModel, table=True):
     access_token: str = Field(default="", max_length=255, index=True, description="访问令牌，带索引")
     download_count: int = Field(default=0, description="下载次数")
     created_at: datetime = Field(default_factory=get_current_timestamp, description="创建时间")
-    updated_at: datetime = Field(default_factory=get_current_timestamp, description="更新时间")
+    updated_at: datetime = Field(
+        default_factory=get_current_timestamp,
+        sa_column_kwargs={"onupdate": get_current_timestamp},
+        description="更新时间，行更新时由SQLAlchemy自动设置"
+    )
     expires_at: datetime = Field(default_factory=get_current_timestamp, description="过期时间，默认为当前时间")
 
     # 关系
@@ -149,4 +175,13 @@ class AccessLog(SQLModel, table=True):
     accessed_at: datetime = Field(default_factory=get_current_timestamp, description="访问时间")
 
     # 关系
-    file_record: Optional[FileRecord] = Relationship(back_populates="access_logs")
\ No newline at end of file
+    file_record: Optional[FileRecord] = Relationship(back_populates="access_logs")
+
+
+# 统计计数器模型
+class StatsCounter(SQLModel, table=True):
+    """统计计数器模型，增量维护各类计数，避免统计接口执行 COUNT 全表扫描"""
+    __tablename__ = "wpic_stats_counters"
+
+    key: str = Field(max_length=100, primary_key=True, description="计数键：users_total/files_active/user:{id}:files/user:{id}:uploads:{YYYYMMDD}")
+    value: int = Field(default=0, description="计数值")
@@ -2,9 +2,13 @@
 图片处理模块
 支持多种图片格式的处理和缩略图生成
 """
+import asyncio
 import hashlib
 import io
-from typing import Optional, Tuple, Dict, Any
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Tuple, Dict, Any, Union, BinaryIO
 
 import pillow_heif
 from PIL import Image, ImageOps, ExifTags
@@ -46,6 +50,14 @@ class ImageProcessor:
         """初始化图片处理器"""
         self.thumbnail_size = settings.app.thumbnail_size
         self.preview_size = settings.app.preview_size
+        
+        # 图片解码和缩放是CPU密集操作，放到线程池执行，Pillow处理像素时会释放GIL
+        self._executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="image")
+    
+    async def _run_in_executor(self, func, *args):
+        """在线程池中执行同步图片处理，避免阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
     
     def is_supported_format(self, file_extension: str) -> bool:
         """检查是否支持的图片格式
@@ -69,11 +81,11 @@ class ImageProcessor:
         """
         return self.SUPPORTED_FORMATS.get(file_extension.lower())
     
-    async def get_image_info(self, image_data: bytes) -> Dict[str, Any]:
+    async def get_image_info(self, image_data: Union[bytes, BinaryIO]) -> Dict[str, Any]:
         """获取图片信息
         
         Args:
-            image_data: 图片数据
+            image_data: 图片数据或已定位到开头的文件对象；传入文件对象时不计算文件哈希
             
         Returns:
             Dict[str, Any]: 图片信息字典
@@ -81,15 +93,20 @@ class ImageProcessor:
         Raises:
             ImageProcessorException: 处理失败时抛出
         """
+        return await self._run_in_executor(self._get_image_info, image_data)
+    
+    def _get_image_info(self, image_data: Union[bytes, BinaryIO]) -> Dict[str, Any]:
+        """同步实现，在线程池中执行"""
         try:
-            with Image.open(io.BytesIO(image_data)) as img:
+            is_bytes = isinstance(image_data, bytes)
+            with Image.open(io.BytesIO(image_data) if is_bytes else image_data) as img:
                 # 基本信息
                 info = {
                     'width': img.width,
                     'height': img.height,
                     'format': img.format,
                     'mode': img.mode,
-                    'size': len(image_data),
+                    'size': len(image_data) if is_bytes else None,
                     'has_transparency': False
                 }
                 
@@ -107,8 +124,12 @@ class ImageProcessor:
                 
                 info['exif'] = exif_data
                 
-                # 文件哈希
-                info['hash'] = hashlib.md5(image_data).hexdigest()
+                # 文件大小和哈希
+                if is_bytes:
+                    info['hash'] = hashlib.md5(image_data).hexdigest()
+                else:
+                    info['size'] = image_data.seek(0, io.SEEK_END)
+                    info['hash'] = None
                 
                 return info
                 
@@ -127,6 +148,10 @@ class ImageProcessor:
         Raises:
             ImageProcessorException: 处理失败时抛出
         """
+        return await self._run_in_executor(self._auto_orient_image, image_data)
+    
+    def _auto_orient_image(self, image_data: bytes) -> bytes:
+        """同步实现，在线程池中执行"""
         try:
             with Image.open(io.BytesIO(image_data)) as img:
                 # 使用ImageOps.exif_transpose自动处理EXIF方向
@@ -170,6 +195,15 @@ class ImageProcessor:
         Raises:
             ImageProcessorException: 处理失败时抛出
         """
+        return await self._run_in_executor(
+            self._resize_image, image_data, size, keep_aspect_ratio, output_format, quality
+        )
+    
+    def _resize_image(self, image_data: bytes, size: Tuple[int, int], 
+                     keep_aspect_ratio: bool = True, 
+                     output_format: str = 'WEBP',
+                     quality: int = 85) -> bytes:
+        """同步实现，在线程池中执行"""
         try:
             with Image.open(io.BytesIO(image_data)) as img:
                 # 自动旋转
@@ -315,6 +349,12 @@ class ImageProcessor:
         Raises:
             ImageProcessorException: 转换失败时抛出
         """
+        return await self._run_in_executor(self._convert_format, image_data, target_format, quality)
+    
+    def _convert_format(self, image_data: bytes, 
+                        target_format: str,
+                        quality: int = 90) -> bytes:
+        """同步实现，在线程池中执行"""
         try:
             with Image.open(io.BytesIO(image_data)) as img:
                 # 自动旋转
@@ -365,6 +405,12 @@ class ImageProcessor:
         Raises:
             ImageProcessorException: 裁剪失败时抛出
         """
+        return await self._run_in_executor(self._crop_image, image_data, box, output_format)
+    
+    def _crop_image(self, image_data: bytes, 
+                    box: Tuple[int, int, int, int],
+                    output_format: str = 'WEBP') -> bytes:
+        """同步实现，在线程池中执行"""
         try:
             with Image.open(io.BytesIO(image_data)) as img:
                 # 自动旋转
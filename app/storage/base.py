@@ -6,6 +6,10 @@ from abc import ABC, abstractmethod
 from typing import Optional, AsyncGenerator, Dict, Any
 
 
+# 文件流分块大小
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 class StorageException(Exception):
     """存储操作异常"""
     pass
@@ -92,11 +96,14 @@ class BaseStorage(ABC):
         """
         pass
     
-    async def get_file_stream(self, file_path: str) -> Optional[AsyncGenerator[bytes, None]]:
+    async def get_file_stream(self, file_path: str, start: int = 0,
+                              end: Optional[int] = None) -> Optional[AsyncGenerator[bytes, None]]:
         """获取文件流（默认实现，子类可重写以优化）
         
         Args:
             file_path: 文件路径
+            start: 起始字节位置
+            end: 结束字节位置（包含），None表示读到文件末尾
             
         Returns:
             Optional[AsyncGenerator[bytes, None]]: 文件流生成器
@@ -105,10 +112,11 @@ class BaseStorage(ABC):
         if file_data is None:
             return None
         
+        stop = len(file_data) if end is None else end + 1
+        
         async def stream():
-            chunk_size = 8192
-            for i in range(0, len(file_data), chunk_size):
-                yield file_data[i:i+chunk_size]
+            for i in range(start, stop, STREAM_CHUNK_SIZE):
+                yield file_data[i:min(i + STREAM_CHUNK_SIZE, stop)]
         
         return stream()
     
@@ -6,7 +6,7 @@ from typing import Optional, AsyncGenerator, Dict, Any
 
 import aiofiles
 
-from .base import BaseStorage, StorageException
+from .base import BaseStorage, StorageException, STREAM_CHUNK_SIZE
 
 
 class LocalStorage(BaseStorage):
@@ -155,11 +155,14 @@ class LocalStorage(BaseStorage):
         except:
             return None
     
-    async def get_file_stream(self, file_path: str) -> Optional[AsyncGenerator[bytes, None]]:
+    async def get_file_stream(self, file_path: str, start: int = 0,
+                              end: Optional[int] = None) -> Optional[AsyncGenerator[bytes, None]]:
         """获取文件流
         
         Args:
             file_path: 文件路径
+            start: 起始字节位置
+            end: 结束字节位置（包含），None表示读到文件末尾
             
         Returns:
             Optional[AsyncGenerator[bytes, None]]: 文件流生成器
@@ -171,11 +174,17 @@ class LocalStorage(BaseStorage):
                 return None
             
             async def stream():
+                remaining = None if end is None else end - start + 1
                 async with aiofiles.open(full_path, 'rb') as f:
-                    while True:
-                        chunk = await f.read(8192)
+                    if start:
+                        await f.seek(start)
+                    while remaining is None or remaining > 0:
+                        size = STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining)
+                        chunk = await f.read(size)
                         if not chunk:
                             break
+                        if remaining is not None:
+                            remaining -= len(chunk)
                         yield chunk
             
             return stream()
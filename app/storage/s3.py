@@ -228,11 +228,14 @@ class S3Storage(BaseStorage):
         except Exception as e:
             raise StorageException(f"获取文件大小失败: {str(e)}")
     
-    async def get_file_stream(self, file_path: str) -> Optional[AsyncGenerator[bytes, None]]:
+    async def get_file_stream(self, file_path: str, start: int = 0,
+                              end: Optional[int] = None) -> Optional[AsyncGenerator[bytes, None]]:
         """获取文件流
         
         Args:
             file_path: 文件路径
+            start: 起始字节位置
+            end: 结束字节位置（包含），None表示读到文件末尾
             
         Returns:
             Optional[AsyncGenerator[bytes, None]]: 文件流生成器
@@ -242,11 +245,13 @@ class S3Storage(BaseStorage):
             
             client = await self._get_async_client()
             
+            # 指定范围时只获取对应字节
+            params = {"Bucket": self.bucket, "Key": key}
+            if start or end is not None:
+                params["Range"] = f"bytes={start}-{'' if end is None else end}"
+            
             try:
-                response = await client.get_object(
-                    Bucket=self.bucket,
-                    Key=key
-                )
+                response = await client.get_object(**params)
                 
                 async def stream():
                     try:
@@ -230,11 +230,14 @@ class WebDAVStorage(BaseStorage):
         except:
             return None
     
-    async def get_file_stream(self, file_path: str) -> Optional[AsyncGenerator[bytes, None]]:
+    async def get_file_stream(self, file_path: str, start: int = 0,
+                              end: Optional[int] = None) -> Optional[AsyncGenerator[bytes, None]]:
         """获取文件流
         
         Args:
             file_path: 文件路径
+            start: 起始字节位置
+            end: 结束字节位置（包含），None表示读到文件末尾
             
         Returns:
             Optional[AsyncGenerator[bytes, None]]: 文件流生成器
@@ -242,14 +245,25 @@ class WebDAVStorage(BaseStorage):
         try:
             url = self._get_full_url(file_path)
             
+            # 指定范围时只获取对应字节
+            extra_headers = None
+            if start or end is not None:
+                extra_headers = {"Range": f"bytes={start}-{'' if end is None else end}"}
+            
             session = aiohttp.ClientSession()
-            response = await session.get(url, headers=self._get_headers())
+            response = await session.get(url, headers=self._get_headers(extra_headers))
             
             if response.status == 404:
                 await session.close()
                 return None
             
-            if response.status != 200:
+            if extra_headers and response.status == 200:
+                # 服务器不支持范围请求时退回到完整读取后截取
+                response.close()
+                await session.close()
+                return await super().get_file_stream(file_path, start, end)
+            
+            if response.status not in (200, 206):
                 await session.close()
                 raise StorageException(f"获取文件流失败: HTTP {response.status}")
             
@@ -2,22 +2,55 @@
 WPIC 图床后端主应用
 一个功能完整的图床后端服务，支持多种存储方式和图片处理功能
 """
+import asyncio
 import os
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
 from app.core.config import get_settings
 from app.core.database import init_database, close_database, create_all_tables, create_default_admin
-from app.core.cache import init_cache, close_cache
+from app.core.cache import init_cache, close_cache, get_cache_manager
 from app.core.logger import logger
+from app.core.request_cache import RequestCacheMiddleware
+from app.crud.file import flush_download_counts, get_active_file_hashes, pop_queued_download_counts
+from app.crud.stats import rebuild_stats_counters
 from app.api.router import api_router
 
 settings = get_settings()
 
+# 下载计数写入数据库的间隔（秒）
+DOWNLOAD_FLUSH_INTERVAL = 10
+
+# 统计计数器重建锁的有效期（秒），期间启动的其他工作进程不再重复重建
+STATS_REBUILD_LOCK_TTL = 300
+
+# 文件哈希集合加载锁的有效期（秒）
+FILE_HASHES_REBUILD_LOCK_TTL = 300
+
+
+async def flush_pending_downloads():
+    """将Redis和进程内累积的下载计数合并后写入数据库"""
+    counts = await get_cache_manager().pop_pending_downloads()
+    for file_id, amount in pop_queued_download_counts().items():
+        counts[file_id] = counts.get(file_id, 0) + amount
+    if counts and not await flush_download_counts(counts):
+        logger.error(f"❌ 写入下载计数失败，丢失 {sum(counts.values())} 次计数")
+
+
+async def download_flush_loop():
+    """定期写入累积的下载计数"""
+    while True:
+        await asyncio.sleep(DOWNLOAD_FLUSH_INTERVAL)
+        try:
+            await flush_pending_downloads()
+        except Exception as e:
+            # 单次写入失败不能终止后台任务
+            logger.error(f"❌ 定期写入下载计数失败: {e}")
+
 
 @asynccontextmanager
 async def lifespan(app_main: FastAPI):
@@ -40,6 +73,23 @@ async def lifespan(app_main: FastAPI):
     # 创建默认管理员用户
     await create_default_admin()
     
+    # 重建统计计数器，多个工作进程同时启动时只由获得锁的进程执行
+    if await get_cache_manager().acquire_lock("stats_rebuild", STATS_REBUILD_LOCK_TTL) is False:
+        logger.info("⏭️ 其他进程已重建统计计数器，跳过")
+    elif await rebuild_stats_counters():
+        logger.info("✅ 统计计数器已重建")
+    else:
+        logger.error("❌ 重建统计计数器失败")
+    
+    # 加载已知文件哈希，用于上传前的重复文件检查；集合只增不减，多个工作进程启动时只由获得锁的进程加载
+    if await get_cache_manager().acquire_lock("file_hashes_rebuild", FILE_HASHES_REBUILD_LOCK_TTL) is False:
+        logger.info("⏭️ 其他进程已加载文件哈希集合，跳过")
+    elif await get_cache_manager().rebuild_file_hashes(await get_active_file_hashes()):
+        logger.info("✅ 文件哈希集合已加载")
+    
+    # 启动下载计数写入任务
+    flush_task = asyncio.create_task(download_flush_loop())
+    
     logger.info(f"🎯 服务启动完成，访问地址: http://{settings.app.host}:{settings.app.port}")
     logger.info(f"📚 API文档地址: http://{settings.app.host}:{settings.app.port}/docs")
     
@@ -47,6 +97,11 @@ async def lifespan(app_main: FastAPI):
     
     # 关闭时清理
     logger.info("🛑 正在关闭服务...")
+    flush_task.cancel()
+    # 等待后台任务退出，避免与最终写入同时取出同一批计数
+    with suppress(asyncio.CancelledError):
+        await flush_task
+    await flush_pending_downloads()
     await close_cache()
     await close_database()
     logger.info("✅ 服务已关闭")
@@ -62,6 +117,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# 添加请求级缓存中间件
+app.add_middleware(RequestCacheMiddleware)
+
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -69,6 +127,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 游标分页的下一页游标需要对跨域前端可见
 )
 
 # 系统级API路由 - 必须在通配符路由之前定义
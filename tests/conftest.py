@@ -0,0 +1,97 @@
+"""
+测试公共夹具
+每个测试使用独立的临时SQLite数据库，Redis权限缓存以进程内字典代替
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+# 必须在导入 app 之前设置，配置首次读取时即使用测试数据库
+_TEST_DIR = tempfile.mkdtemp(prefix="wpic-test-")
+os.environ["DB_DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'wpic.db')}"
+os.environ["SECURITY_ENABLE_AUTH"] = "true"
+os.environ["APP_HASH_ALGORITHM"] = "md5"
+
+import pytest
+from sqlmodel import SQLModel
+
+from app.core import database
+from app.core.cache import get_cache_manager
+from app.core.security import get_auth_manager
+from app.crud import user as user_crud
+
+
+@pytest.fixture
+async def db():
+    """为每个测试重建数据库表，结束后释放引擎（aiosqlite连接绑定在当前事件循环上）"""
+    engine = database.get_engine()
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.drop_all)
+    await database.create_all_tables()
+    yield engine
+    await database.close_database()
+    database._engine = None
+    database._session_factory = None
+
+
+@pytest.fixture(autouse=True)
+def clear_process_caches():
+    """清空进程内的用户和权限缓存，避免测试之间互相影响"""
+    auth_manager = get_auth_manager()
+    auth_manager._user_cache.clear()
+    auth_manager._file_access_cache.clear()
+    auth_manager._token_cache.clear()
+    user_crud._user_lookup_cache.clear()
+    user_crud._user_lookup_keys.clear()
+    yield
+
+
+class FakeFileAccessCache:
+    """以字典模拟 Redis 中的 wpic:acl:{file_id} 哈希表"""
+
+    def __init__(self):
+        self.entries = {}
+
+    async def set_file_access_cache(self, file_id, user_id, entry, ttl=30):
+        self.entries.setdefault(file_id, {})[user_id or 0] = entry
+        return True
+
+    async def get_file_access_cache(self, file_id, user_id):
+        return self.entries.get(file_id, {}).get(user_id or 0)
+
+    async def delete_file_access_cache(self, file_id):
+        self.entries.pop(file_id, None)
+        return True
+
+
+@pytest.fixture
+def acl_cache(monkeypatch):
+    """替换缓存管理器的权限缓存方法"""
+    fake = FakeFileAccessCache()
+    cache_manager = get_cache_manager()
+    for name in ("set_file_access_cache", "get_file_access_cache", "delete_file_access_cache"):
+        monkeypatch.setattr(cache_manager, name, getattr(fake, name))
+    return fake
+
+
+@pytest.fixture
+def file_data():
+    """生成文件记录字段，过期时间设在未来，避免按默认值立即过期"""
+    counter = iter(range(1, 1_000_000))
+
+    def build(**overrides):
+        index = next(counter)
+        data = {
+            "filename": f"file-{index}.png",
+            "original_filename": f"file-{index}.png",
+            "file_path": f"2026/10/15/file-{index}.png",
+            "file_size": 1024,
+            "content_type": "image/png",
+            "file_hash": f"{index:032x}",
+            "format": "png",
+            "expires_at": datetime.now() + timedelta(days=1),
+        }
+        data.update(overrides)
+        return data
+
+    return build
@@ -0,0 +1,44 @@
+"""
+管理员令牌声明校验测试
+"""
+from app.core.security import ADMIN_USER_ID, get_auth_manager
+from app.crud.user import create_user, update_user
+
+
+async def _create_admin():
+    admin = await create_user("admin", "admin@example.com", "password")
+    assert admin.id == ADMIN_USER_ID
+    return admin
+
+
+async def test_admin_claim_returns_active_admin(db):
+    auth_manager = get_auth_manager()
+    admin = await _create_admin()
+    token = auth_manager.create_access_token(auth_manager.build_token_data(admin))
+
+    user = await auth_manager.get_admin_from_token(token)
+    assert user is not None
+    assert user.id == admin.id
+    assert user.email == admin.email
+
+
+async def test_admin_claim_rejected_for_inactive_user(db):
+    auth_manager = get_auth_manager()
+    admin = await _create_admin()
+    token = auth_manager.create_access_token(auth_manager.build_token_data(admin))
+
+    await update_user(admin.id, is_active=False)
+
+    assert await auth_manager.get_admin_from_token(token) is None
+
+
+async def test_admin_claim_rejected_for_non_access_token(db):
+    auth_manager = get_auth_manager()
+    admin = await _create_admin()
+
+    for token_type in ("file_access", "share_link", None):
+        data = {"sub": str(admin.id), "username": admin.username, "adm": 1}
+        if token_type:
+            data["type"] = token_type
+        token = auth_manager.create_access_token(data)
+        assert await auth_manager.get_admin_from_token(token) is None
@@ -0,0 +1,74 @@
+"""
+文件访问权限缓存失效测试
+"""
+import pytest
+from fastapi import HTTPException
+
+from app.core.security import get_auth_manager, verify_file_access_cached
+from app.crud.file import create_file_record, delete_file_record, update_file_record
+from app.crud.user import create_user
+
+
+async def test_cached_denial_is_cleared_on_upload(db, acl_cache, file_data):
+    """新文件ID上缓存的“不存在”结果在创建文件记录时清除"""
+    user = await create_user("owner", "owner@example.com", "password")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await verify_file_access_cached(1, user)
+    assert exc_info.value.status_code == 404
+    assert acl_cache.entries[1][user.id]["denied"] == 404
+
+    file_record = await create_file_record(user.id, **file_data())
+    assert file_record.id == 1
+    assert 1 not in acl_cache.entries
+
+    assert (await verify_file_access_cached(1, user)).id == 1
+
+
+async def test_cached_grant_is_cleared_on_delete(db, acl_cache, file_data):
+    """删除文件后进程内和共享的权限缓存均被清除，再次访问被拒绝"""
+    user = await create_user("owner", "owner@example.com", "password")
+    file_record = await create_file_record(user.id, **file_data())
+
+    await verify_file_access_cached(file_record.id, user)
+    assert get_auth_manager().get_cached_file_access(user.id, file_record.id) is not None
+    assert file_record.id in acl_cache.entries
+
+    assert await delete_file_record(file_record.id, user.id)
+    assert get_auth_manager().get_cached_file_access(user.id, file_record.id) is None
+    assert file_record.id not in acl_cache.entries
+
+    with pytest.raises(HTTPException) as exc_info:
+        await verify_file_access_cached(file_record.id, user)
+    assert exc_info.value.status_code == 403
+
+
+async def test_shared_cache_entry_excludes_secrets(db, acl_cache, file_data):
+    """共享缓存中不保存分享令牌和所属用户的存储配置"""
+    user = await create_user("owner", "owner@example.com", "password", storage_config={"secret_key": "s3cr3t"})
+    file_record = await create_file_record(user.id, **file_data())
+    await update_file_record(file_record.id, access_token="share-token")
+
+    await verify_file_access_cached(file_record.id, user)
+    entry = acl_cache.entries[file_record.id][user.id]
+
+    assert "access_token" not in entry["file"]
+    assert "user" not in entry["file"]
+    assert "s3cr3t" not in repr(entry)
+
+
+async def test_database_error_is_not_cached_as_denial(db, acl_cache, monkeypatch):
+    """文件查询失败时返回503，不会作为“不存在”写入共享缓存"""
+    from app.core import loaders
+
+    user = await create_user("owner", "owner@example.com", "password")
+
+    async def failing_get_files_by_ids(file_ids):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(loaders, "get_files_by_ids", failing_get_files_by_ids)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await verify_file_access_cached(1, user)
+    assert exc_info.value.status_code == 503
+    assert 1 not in acl_cache.entries
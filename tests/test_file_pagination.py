@@ -0,0 +1,53 @@
+"""
+文件列表游标分页与页码分页一致性测试
+"""
+import pytest
+from fastapi import HTTPException, Response
+
+from app.crud.file import (
+    create_file_record, get_user_file_cursor, get_user_files, get_user_files_page, hard_delete_file_record
+)
+from app.crud.user import create_user
+
+
+async def _create_users(count: int):
+    return [await create_user(f"user{i}", f"user{i}@example.com", "password") for i in range(count)]
+
+
+async def test_file_cursor_pages_match_offset_pages(db, file_data):
+    """文件列表按 (created_at, id) 游标翻页的结果与页码分页一致"""
+    user = (await _create_users(1))[0]
+    for _ in range(5):
+        await create_file_record(user.id, **file_data())
+
+    first_page, total = await get_user_files_page(user.id, 0, 2)
+    offset_page, _ = await get_user_files_page(user.id, 2, 2)
+    cursor = await get_user_file_cursor(user.id, first_page[-1].id)
+    cursor_page = await get_user_files(user.id, limit=2, cursor=cursor)
+
+    assert total == 5
+    assert [f.id for f in cursor_page] == [f.id for f in offset_page]
+
+
+async def test_file_cursor_of_other_user_is_rejected(db, file_data):
+    """游标只能引用当前用户自己的文件"""
+    owner, other = await _create_users(2)
+    file_record = await create_file_record(owner.id, **file_data())
+
+    assert await get_user_file_cursor(other.id, file_record.id) is None
+
+
+async def test_deleted_file_cursor_returns_400(db, file_data):
+    """游标文件被彻底删除后返回400，而不是静默返回空页"""
+    from app.api.file_routes import get_file_list
+
+    user = (await _create_users(1))[0]
+    file_records = [await create_file_record(user.id, **file_data()) for _ in range(3)]
+    assert await hard_delete_file_record(file_records[1].id)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await get_file_list(
+            response=Response(), page=1, page_size=2, status_filter=None, format_filter=None,
+            cursor_id=file_records[1].id, current_user=user
+        )
+    assert exc_info.value.status_code == 400
@@ -0,0 +1,36 @@
+"""
+模型字段测试
+"""
+from app.crud.user import create_user, get_session, update_user
+from app.models import User
+
+STORAGE_CONFIG = {
+    "bucket": "wpic",
+    "endpoint": "https://s3.example.com",
+    "use_ssl": True,
+    "options": {"retries": 3, "regions": ["us-east-1", "eu-west-1"]},
+}
+
+
+async def test_storage_config_json_round_trip(db):
+    """SQLite 下 storage_config 以JSON保存，读取后仍为原字典"""
+    user = await create_user("s3user", "s3user@example.com", "password", storage_type="s3",
+                             storage_config=STORAGE_CONFIG)
+
+    async with get_session() as session:
+        loaded = await session.get(User, user.id)
+    assert loaded.storage_config == STORAGE_CONFIG
+
+    updated_config = {**STORAGE_CONFIG, "bucket": "wpic-2"}
+    await update_user(user.id, storage_config=updated_config)
+    async with get_session() as session:
+        loaded = await session.get(User, user.id)
+    assert loaded.storage_config == updated_config
+
+
+async def test_storage_config_defaults_to_empty_dict(db):
+    user = await create_user("plain", "plain@example.com", "password")
+
+    async with get_session() as session:
+        loaded = await session.get(User, user.id)
+    assert loaded.storage_config == {}
@@ -0,0 +1,45 @@
+"""
+统计计数器测试
+"""
+import asyncio
+
+from sqlmodel import select
+
+from app.crud.stats import get_session, incr_counters
+from app.models import StatsCounter
+
+
+async def _increment(key: str, delta: int):
+    async with get_session() as session:
+        await incr_counters(session, {key: delta})
+        await session.commit()
+
+
+async def test_concurrent_incr_counters_on_new_key(db):
+    """多个事务同时对不存在的计数键加一，不应因主键冲突丢失计数"""
+    key = "user:1:uploads:20261015"
+    await asyncio.gather(*(_increment(key, 1) for _ in range(20)))
+
+    async with get_session() as session:
+        value = (await session.exec(select(StatsCounter.value).where(StatsCounter.key == key))).one()
+    assert value == 20
+
+
+async def test_negative_delta_does_not_create_counter(db):
+    """负增量不会为不存在的计数键创建值为0的行"""
+    await _increment("user:1:uploads:20200101", -1)
+
+    async with get_session() as session:
+        assert await session.get(StatsCounter, "user:1:uploads:20200101") is None
+
+
+async def test_counter_reaching_zero_is_removed(db):
+    """计数减到0后删除该行，未减到0时正常扣减"""
+    await _increment("user:1:files", 2)
+    await _increment("user:1:files", -1)
+    async with get_session() as session:
+        assert (await session.get(StatsCounter, "user:1:files")).value == 1
+
+    await _increment("user:1:files", -1)
+    async with get_session() as session:
+        assert await session.get(StatsCounter, "user:1:files") is None
@@ -0,0 +1,20 @@
+"""
+用户列表游标分页与页码分页一致性测试
+"""
+from app.crud.user import create_user, get_users_paginated
+
+
+async def _create_users(count: int):
+    return [await create_user(f"user{i}", f"user{i}@example.com", "password") for i in range(count)]
+
+
+async def test_user_cursor_pages_match_offset_pages(db):
+    """游标分页与页码分页使用相同排序，上一页最后一个ID可直接作为游标"""
+    await _create_users(5)
+
+    first_page = await get_users_paginated(0, 2)
+    offset_page = await get_users_paginated(2, 2)
+    cursor_page = await get_users_paginated(limit=2, cursor_id=first_page[-1].id)
+
+    assert [row.id for row in cursor_page] == [row.id for row in offset_page]
+    assert [row.id for row in first_page + offset_page] == sorted((row.id for row in first_page + offset_page), reverse=True)